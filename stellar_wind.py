@@ -1,10 +1,18 @@
+import hashlib
+import importlib
+import timeit
+import warnings
 import numpy
 
+from collections import OrderedDict
+
 from amuse.support.exceptions import AmuseException
-from amuse.datamodel import Particles
+from amuse.datamodel import Particles, base as datamodel_base
 from amuse.units import units, quantities, constants
 
-from amuse.ext.evrard_test import uniform_unit_sphere
+KB_SI = constants.kB.value_in(units.J/units.K)
+WIND_VECTOR_ATTRIBUTES = {"position": ("x", "y", "z"),
+                          "velocity": ("vx", "vy", "vz")}
 
 
 def kudritzki_wind_velocity(mass, radius, luminosity, temperature,
@@ -33,7 +41,393 @@ def kudritzki_wind_velocity(mass, radius, luminosity, temperature,
     return v_esc * numpy.select(condlist, choicelist)
 
 
+STELLAR_ATTRIBUTES = ("mass", "radius", "luminosity", "temperature")
+
+wind_velocity_prescriptions = {
+    "kudritzki": (kudritzki_wind_velocity, STELLAR_ATTRIBUTES),
+}
+
+
+def register_wind_velocity_prescription(name, function,
+                                        attribute_names=STELLAR_ATTRIBUTES):
+    """
+        Register an empirical terminal wind velocity prescription, which
+        can then be chosen with the wind_velocity_prescription argument of
+        the wind codes. 'function' is called with the arrays of the
+        'attribute_names' of all stars at once and has to return the
+        terminal wind velocities.
+    """
+    wind_velocity_prescriptions[name] = (function, tuple(attribute_names))
+
+
+def scipy_function(module, name):
+    """
+        Look up a SciPy function, importing SciPy only when it is needed.
+    """
+    try:
+        module = importlib.import_module("scipy." + module)
+    except ImportError:
+        raise AmuseException("Importing SciPy has failed")
+    return getattr(module, name)
+
+
+class NoStats(object):
+    """
+        Stand in for WindStats when instrumentation is switched off;
+        every method does nothing.
+    """
+
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def phase(self, name):
+        return self
+
+    def count(self, name, number=1):
+        pass
+
+    def emit(self, key, number):
+        pass
+
+    def stop(self):
+        pass
+
+
+NO_STATS = NoStats()
+
+
+class WindStats(object):
+    """
+        Wall times and call counts per phase, counters (quad and brentq
+        calls, integrand evaluations, rejection loop iterations, gravity
+        cache hits) and the number of particles emitted per star.
+        With track_memory the net number of bytes allocated in every phase
+        is measured using tracemalloc, which is stopped again by stop() if
+        it was started for this.
+    """
+
+    enabled = True
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.started_tracing = False
+        self.reset()
+
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+        self.allocated = {}
+        self.counters = {}
+        self.emitted = {}
+
+    def phase(self, name):
+        return _StatsPhase(self, name)
+
+    def count(self, name, number=1):
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def emit(self, key, number):
+        self.emitted[key] = self.emitted.get(key, 0) + number
+
+    def stop(self):
+        if self.started_tracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def as_dict(self):
+        return {"times": dict(self.times), "calls": dict(self.calls),
+                "allocated": dict(self.allocated),
+                "counters": dict(self.counters),
+                "emitted": dict(self.emitted)}
+
+    def __str__(self):
+        lines = ["{0:24s} {1:>8s} {2:>12s}".format("phase", "calls",
+                                                   "time [s]")]
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append("{0:24s} {1:8d} {2:12.4f}".format(
+                name, self.calls[name], self.times[name]))
+        for name in sorted(self.counters):
+            lines.append("{0:24s} {1:8d}".format(name, self.counters[name]))
+        lines.append("{0:24s} {1:8d}".format("particles emitted",
+                                              sum(self.emitted.values())))
+        return "\n".join(lines)
+
+
+class _StatsPhase(object):
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        if self.stats.track_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.stats.started_tracing = True
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *args):
+        stats, name = self.stats, self.name
+        stats.times[name] = (stats.times.get(name, 0.)
+                             + timeit.default_timer() - self.start)
+        stats.calls[name] = stats.calls.get(name, 0) + 1
+        if stats.track_memory:
+            import tracemalloc
+            allocated = tracemalloc.get_traced_memory()[0] - self.memory
+            stats.allocated[name] = stats.allocated.get(name, 0) + allocated
+        return False
+
+
+class NumpyKernels(object):
+    """
+        The inner numerical kernels of the wind codes, working on plain
+        float arrays in SI units. All per point arguments are broadcast
+        against each other; scalars give scalar results.
+    """
+
+    name = "numpy"
+
+    def prepare(self, *arrays):
+        arrays = numpy.broadcast_arrays(*[numpy.asarray(a, dtype=numpy.float64)
+                                          for a in arrays])
+        shape = arrays[0].shape
+        return shape, [numpy.ascontiguousarray(a).ravel() for a in arrays]
+
+    def finish(self, shape, *results):
+        if shape == ():
+            results = [r[0] for r in results]
+        else:
+            results = [r.reshape(shape) for r in results]
+        return results[0] if len(results) == 1 else results
+
+    def logistic_profile(self, r, v_init, v_end, r_mid, steepness, cutoff):
+        """
+            velocity and acceleration of the logistic velocity law,
+            v = v_end and a = 0 beyond the cutoff radius.
+        """
+        shape, args = self.prepare(r, v_init, v_end, r_mid, steepness, cutoff)
+        return self.finish(shape, *self.logistic_kernel(*args))
+
+    def pressure_acceleration(self, r, v, a, u, m_dot, v_init, r_star,
+                              gamma):
+        shape, args = self.prepare(r, v, a, u, m_dot, v_init, r_star, gamma)
+        return self.finish(shape, self.pressure_kernel(*args))
+
+    def atmospheric_acceleration(self, r, v, m_dot, v_surface, r_star,
+                                 g, temperature, mu):
+        shape, args = self.prepare(r, v, m_dot, v_surface, r_star,
+                                   g, temperature, mu)
+        return self.finish(shape, self.atmospheric_kernel(*args))
+
+    def unit_vectors(self, vectors):
+        """ returns the unit vectors and lengths of (N, 3) vectors """
+        vectors = numpy.ascontiguousarray(vectors, dtype=numpy.float64)
+        return self.unit_vectors_kernel(vectors)
+
+    def scale_vectors(self, vectors, lengths):
+        """ multiplies each of the (N, 3) vectors with its length """
+        vectors = numpy.ascontiguousarray(vectors, dtype=numpy.float64)
+        lengths = numpy.ascontiguousarray(lengths, dtype=numpy.float64)
+        return self.scale_vectors_kernel(vectors, lengths)
+
+    @staticmethod
+    def logistic_kernel(r, v_init, v_end, r_mid, steepness, cutoff):
+        exp = numpy.exp(-steepness * (r - r_mid) / r_mid)
+        v = v_init + (v_end - v_init) / (1. + exp)
+        a = v * (steepness * (v_end - v_init) * exp
+                 / (r_mid * (1. + exp)**2))
+        outside = r > cutoff
+        return numpy.where(outside, v_end, v), numpy.where(outside, 0., a)
+
+    @staticmethod
+    def pressure_kernel(r, v, a, u, m_dot, v_init, r_star, gamma):
+        rho = m_dot / (4 * numpy.pi * v * r**2)
+        rho_init = m_dot / (4. * numpy.pi * v_init * r_star**2)
+        k = (gamma-1) * rho_init**(1-gamma) * u
+        return gamma * k * rho**(gamma-1) * (2./r + a/v/v)
+
+    @staticmethod
+    def atmospheric_kernel(r, v, m_dot, v_surface, r_star, g, temperature,
+                           mu):
+        h = (KB_SI * temperature)/(g*mu)
+        rho = m_dot / (4 * numpy.pi * v * r**2)
+        rho_surface = m_dot / (4 * numpy.pi * v_surface * r_star**2)
+        pressure_surface = rho_surface * KB_SI * temperature / mu
+        return pressure_surface / (rho * h) * numpy.exp(-(r-r_star)/h)
+
+    @staticmethod
+    def unit_vectors_kernel(vectors):
+        lengths = numpy.sqrt((vectors**2).sum(1))
+        return vectors / lengths[:, None], lengths
+
+    @staticmethod
+    def scale_vectors_kernel(vectors, lengths):
+        return vectors * lengths[:, None]
+
+
+class NumbaKernels(NumpyKernels):
+    """
+        The same kernels as NumpyKernels, compiled with Numba into single
+        pass loops that run in parallel over the particles.
+    """
+
+    name = "numba"
+
+    def __init__(self):
+        import numba
+        prange = numba.prange
+        jit = numba.njit(parallel=True, cache=True)
+
+        def logistic_kernel(r, v_init, v_end, r_mid, steepness, cutoff):
+            v = numpy.empty(r.shape[0])
+            a = numpy.empty(r.shape[0])
+            for i in prange(r.shape[0]):
+                if r[i] > cutoff[i]:
+                    v[i] = v_end[i]
+                    a[i] = 0.
+                else:
+                    exp = numpy.exp(-steepness[i] * (r[i] - r_mid[i])
+                                    / r_mid[i])
+                    v[i] = v_init[i] + (v_end[i] - v_init[i]) / (1. + exp)
+                    a[i] = v[i] * (steepness[i] * (v_end[i] - v_init[i]) * exp
+                                   / (r_mid[i] * (1. + exp)**2))
+            return v, a
+
+        def pressure_kernel(r, v, a, u, m_dot, v_init, r_star, gamma):
+            acc = numpy.empty(r.shape[0])
+            for i in prange(r.shape[0]):
+                rho = m_dot[i] / (4 * numpy.pi * v[i] * r[i]**2)
+                rho_init = m_dot[i] / (4. * numpy.pi * v_init[i]
+                                       * r_star[i]**2)
+                k = (gamma[i]-1) * rho_init**(1-gamma[i]) * u[i]
+                acc[i] = (gamma[i] * k * rho**(gamma[i]-1)
+                          * (2./r[i] + a[i]/v[i]/v[i]))
+            return acc
+
+        def atmospheric_kernel(r, v, m_dot, v_surface, r_star, g,
+                               temperature, mu):
+            acc = numpy.empty(r.shape[0])
+            for i in prange(r.shape[0]):
+                h = (KB_SI * temperature[i])/(g[i]*mu[i])
+                rho = m_dot[i] / (4 * numpy.pi * v[i] * r[i]**2)
+                rho_surface = m_dot[i] / (4 * numpy.pi * v_surface[i]
+                                          * r_star[i]**2)
+                pressure_surface = (rho_surface * KB_SI * temperature[i]
+                                    / mu[i])
+                acc[i] = (pressure_surface / (rho * h)
+                          * numpy.exp(-(r[i]-r_star[i])/h))
+            return acc
+
+        def unit_vectors_kernel(vectors):
+            unit_vectors = numpy.empty(vectors.shape)
+            lengths = numpy.empty(vectors.shape[0])
+            for i in prange(vectors.shape[0]):
+                lengths[i] = numpy.sqrt(vectors[i, 0]**2 + vectors[i, 1]**2
+                                        + vectors[i, 2]**2)
+                for j in range(3):
+                    unit_vectors[i, j] = vectors[i, j] / lengths[i]
+            return unit_vectors, lengths
+
+        def scale_vectors_kernel(vectors, lengths):
+            result = numpy.empty(vectors.shape)
+            for i in prange(vectors.shape[0]):
+                for j in range(3):
+                    result[i, j] = vectors[i, j] * lengths[i]
+            return result
+
+        self.logistic_kernel = jit(logistic_kernel)
+        self.pressure_kernel = jit(pressure_kernel)
+        self.atmospheric_kernel = jit(atmospheric_kernel)
+        self.unit_vectors_kernel = jit(unit_vectors_kernel)
+        self.scale_vectors_kernel = jit(scale_vectors_kernel)
+
+
+kernel_backends = {"numpy": NumpyKernels,
+                   "numba": NumbaKernels,
+                   }
+_kernels = NumpyKernels()
+
+
+def set_kernel_backend(backend="auto"):
+    """
+        Select the backend of the numerical kernels: 'numpy', 'numba' or
+        'auto', which uses Numba when it is installed. Both backends give
+        the same results up to rounding.
+    """
+    global _kernels
+    if backend == "auto":
+        try:
+            _kernels = NumbaKernels()
+        except ImportError:
+            _kernels = NumpyKernels()
+        return _kernels.name
+
+    try:
+        _kernels = kernel_backends[backend]()
+    except ImportError:
+        raise AmuseException("Kernel backend '{0}' is not available"
+                             .format(backend))
+    return _kernels.name
+
+
+def wind_kernels():
+    return _kernels
+
+
+def interpolate_rows(x, rows, xp, fp):
+    """
+        Linear interpolation of every x in its own row of the tables xp
+        and fp. The rows of xp have to increase from 0 to 1.
+    """
+    n = xp.shape[1]
+    offsets = 2. * numpy.arange(len(xp))
+    flat_xp = (xp + offsets[:, None]).ravel()
+    flat_fp = fp.ravel()
+
+    x = numpy.clip(x, 0., 1.) + offsets[rows]
+    high = numpy.searchsorted(flat_xp, x)
+    high = numpy.clip(high, rows * n + 1, rows * n + n - 1)
+    low = high - 1
+
+    width = flat_xp[high] - flat_xp[low]
+    weight = numpy.where(width > 0, (x - flat_xp[low]) / numpy.where(
+        width > 0, width, 1.), 0.)
+    return flat_fp[low] + weight * (flat_fp[high] - flat_fp[low])
+
+
+def travel_time_table(r_star, r_out, table_size, velocity):
+    """
+        Radii from r_star to r_out, one row per star, and the time it takes
+        the wind to get there from r_star. velocity(radii) gives the wind
+        speed in m/s, for one or more sets of rows. The logarithm of the
+        radii goes with the square of the table index, so that the table
+        is densest near the surface, where the wind accelerates most and
+        the density is highest, and still reaches far out. The times are
+        in the unit of the radii divided by m/s.
+    """
+    steps = numpy.linspace(0., 1., table_size)**2
+    ratio = numpy.maximum(r_out / r_star, 1.)
+    radii = r_star[:, None] * ratio[:, None]**steps
+
+    inverse = 1. / velocity(radii)
+    times = numpy.zeros(inverse.shape)
+    times[..., 1:] = numpy.cumsum(0.5 * (inverse[..., 1:] + inverse[..., :-1])
+                                  * numpy.diff(radii, axis=-1), axis=-1)
+    return radii, times
+
+
 class PositionGenerator(object):
+    stats = NO_STATS
+    random = numpy.random
+
     def __init__(self, grid_type="random"):
         self.cube_generator = {
             "random": self.random_cube,
@@ -77,28 +471,32 @@ class PositionGenerator(object):
         a=numpy.where((x>=-1) & (y>=-1) & (z>=-1) & (x<1) & (y<1) & (z<1) )[0]
         return x[a],y[a],z[a]
 
-    def random_cube(self, N):
-        numbers = numpy.random.uniform(-1., 1., 3 * N)
+    def random_cube(self, N, random=None):
+        if random is None:
+            random = self.random
+        numbers = random.uniform(-1., 1., 3 * N)
         return numpy.reshape(numbers, (N, 3))
 
     def cutout_sphere(self, positions, rmin):
         r = numpy.sqrt((positions**2).sum(1))
         return positions[(r >= rmin) & (r < 1)]
 
-    def uniform_hollow_sphere(self, N, rmin):
+    def uniform_hollow_sphere(self, N, rmin, random=None):
         cube_sphere_ratio = 4/3. * numpy.pi * 0.5**3 * (1 - rmin**3)
         estimatedN = N / cube_sphere_ratio
 
         while True:
+            self.stats.count("rejection_iterations")
             estimatedN = estimatedN * 1.1 + 1
-            cube = self.cube_generator(int(estimatedN))
+            cube = self.cube_generator(int(estimatedN), random)
             hollow_sphere = self.cutout_sphere(cube, rmin)
             if len(hollow_sphere) >= N:
                 break
 
         return hollow_sphere[:N]
 
-    def generate_positions(self, N, rmin, rmax, radius_function=None, star=None):
+    def generate_positions(self, N, rmin, rmax, radius_function=None,
+                           star=None, random=None):
         """
             The particles start out in a (random) position between
             the surface of the star and the distance that the
@@ -107,11 +505,17 @@ class PositionGenerator(object):
             comparable to the previous wind velocity.
 
             Note that the stellar position is not added yet here.
+            The random numbers are drawn from 'random', or from
+            numpy.random by default.
         """
-        positions = self.uniform_hollow_sphere(N, 1. * rmin / rmax)
-        vector_lengths = numpy.sqrt((positions**2).sum(1))
+        with self.stats.phase("generate_positions"):
+            return self.positions_in_shell(N, rmin, rmax, radius_function,
+                                           star, random)
 
-        unit_vectors = positions/self.as_three_vector(vector_lengths)
+    def positions_in_shell(self, N, rmin, rmax, radius_function, star,
+                           random=None):
+        positions = self.uniform_hollow_sphere(N, 1. * rmin / rmax, random)
+        unit_vectors, vector_lengths = wind_kernels().unit_vectors(positions)
 
         int_v_over_total = ((vector_lengths * rmax)**3 - rmin**3) / (rmax**3 - rmin**3)
 
@@ -120,17 +524,120 @@ class PositionGenerator(object):
         else:
 
             distance = int_v_over_total * (rmax - rmin) + rmin
-        position = unit_vectors * self.as_three_vector(distance)
+        if quantities.is_quantity(distance):
+            position = wind_kernels().scale_vectors(
+                unit_vectors, distance.value_in(units.m)) | units.m
+        else:
+            position = wind_kernels().scale_vectors(unit_vectors, distance)
 
         return position, unit_vectors
 
 
+class ParticleMassPolicy(object):
+    """
+        Base class of the SPH particle mass policies. A policy decides
+        which particle mass is used for the wind of each star. The default
+        policy simply uses the fixed sph_particle_mass of the wind code.
+    """
+
+    def particle_mass(self, stars, wind):
+        """
+            The particle mass for a single star or for a set of stars.
+        """
+        return wind.sph_particle_mass
+
+    def keep_particles(self, positions, star, random):
+        """
+            A mask of the particles at 'positions' (relative to the star)
+            that are kept, or None to keep all of them. The released mass
+            is divided over the particles that are kept.
+        """
+        return None
+
+    def particle_masses(self, positions, star, mass):
+        """
+            Divide the released mass over the particles at 'positions'
+            (relative to the star). The total has to be len(positions) * mass.
+        """
+        return numpy.ones(len(positions)) * mass
+
+    def clip_mass(self, mass, wind, min_ratio, max_ratio):
+        base = wind.sph_particle_mass
+        value = numpy.clip(mass.value_in(base.unit),
+                           min_ratio * base.number, max_ratio * base.number)
+        return value | base.unit
+
+
+class TargetRateParticleMass(ParticleMassPolicy):
+    """
+        Choose the particle mass such that every star emits about 'rate'
+        particles per unit time. Weak winds get light particles and strong
+        winds heavy ones, which keeps the particle budget roughly constant.
+        If per_star is False, 'rate' is the emission rate of the whole
+        cluster and all stars share the same (time dependent) particle mass.
+        The mass is clipped between min_ratio and max_ratio times the
+        sph_particle_mass of the wind code.
+    """
+
+    def __init__(self, rate, per_star=True, min_ratio=0.1, max_ratio=10.):
+        self.rate = rate
+        self.per_star = per_star
+        self.min_ratio = min_ratio
+        self.max_ratio = max_ratio
+
+    def particle_mass(self, stars, wind):
+        if self.per_star:
+            mass_loss_rate = stars.wind_mass_loss_rate
+        else:
+            mass_loss_rate = wind.particles.wind_mass_loss_rate.sum()
+        mass = mass_loss_rate / self.rate
+        return self.clip_mass(mass, wind, self.min_ratio, self.max_ratio)
+
+
+class RadialParticleMass(ParticleMassPolicy):
+    """
+        Particles further from the star get a higher mass, scaling with
+        (r/R_star)**power. Useful for the thick r_max shells of
+        MechanicalLuminosityWind, where the outer particles are spread out
+        over a large volume anyway. The particles are drawn with the mass
+        of the base policy and then thinned, keeping a particle with
+        probability (r_in/r)**power, where r_in is the distance of the
+        innermost new particle, so the number density follows
+        rho(r)/m(r) and the mass profile of the wind is not changed: there
+        are just fewer, heavier particles far from the star. The released
+        mass is not changed.
+    """
+
+    def __init__(self, power=1., base_policy=None):
+        self.power = power
+        self.base_policy = base_policy or ParticleMassPolicy()
+
+    def particle_mass(self, stars, wind):
+        return self.base_policy.particle_mass(stars, wind)
+
+    def keep_particles(self, positions, star, random):
+        if len(positions) == 0:
+            return None
+        r = positions.lengths()
+        probability = (r.min() / r)**self.power
+        return random.uniform(0., 1., len(positions)) < probability
+
+    def particle_masses(self, positions, star, mass):
+        if len(positions) == 0:
+            return numpy.ones(0) * mass
+        r = positions.lengths()
+        weights = (r / star.radius)**self.power
+        return mass * len(positions) * weights / weights.sum()
+
+
 class StarsWithMassLoss(Particles):
     def __init__(self, *args, **kwargs):
         super(StarsWithMassLoss, self).__init__(*args, **kwargs)
         self.collection_attributes.timestamp = 0. | units.yr
         self.collection_attributes.previous_time = 0. | units.yr
         self.collection_attributes.track_mechanical_energy = False
+        self.collection_attributes.wind_velocity_prescription = None
+        self.collection_attributes.initial_wind_velocity_ratio = None
 
     def add_particles(self, particles, *args, **kwargs):
         new_particles = super(StarsWithMassLoss, self).add_particles(
@@ -162,13 +669,59 @@ class StarsWithMassLoss(Particles):
                 new_particles.previous_mechanical_luminosity = -1 | units.W
                 self.collection_attributes.new_unset_lmech_particles = True
 
+        self.update_wind_velocities()
         return new_particles
 
+    def set_wind_velocity_prescription(self, prescription):
+        """
+            A (function, attribute_names) pair from which the
+            terminal_wind_velocity is derived, or None if it is given.
+        """
+        self.collection_attributes.wind_velocity_prescription = prescription
+        self.update_wind_velocities()
+
+    def set_initial_wind_velocity_ratio(self, ratio):
+        """
+            Set initial_wind_velocity to 'ratio' times the terminal wind
+            velocity, or leave it to the user if ratio is None.
+        """
+        self.collection_attributes.initial_wind_velocity_ratio = ratio
+        self.update_wind_velocities()
+
+    def update_wind_velocities(self):
+        """
+            Evaluate the wind velocity prescription for all stars in one
+            vectorized call and store terminal_wind_velocity and
+            initial_wind_velocity as a snapshot, which the per star code
+            reads instead of recomputing it. This is done when stars are
+            added and on every evolve_mass_loss (i.e. every timestep of the
+            wind code), and by AcceleratingWind before the gravity,
+            potential or timestep when the stars have changed; call it
+            yourself when changing the stars otherwise.
+            Stars that miss the required attributes are left alone.
+        """
+        if len(self) == 0:
+            return
+        defined = self.get_attribute_names_defined_in_store()
+        prescription = self.collection_attributes.wind_velocity_prescription
+        if prescription is not None:
+            function, names = prescription
+            if all(name in defined for name in names):
+                self.terminal_wind_velocity = function(
+                    *[getattr(self, name) for name in names])
+                defined.append("terminal_wind_velocity")
+
+        ratio = self.collection_attributes.initial_wind_velocity_ratio
+        if ratio is not None and "terminal_wind_velocity" in defined:
+            self.initial_wind_velocity = ratio * self.terminal_wind_velocity
+
     def evolve_mass_loss(self, time):
         if self.collection_attributes.previous_time > time:
             # TODO: do we really need this check? Why?
             return
 
+        self.update_wind_velocities()
+
         elapsed_time = time - self.collection_attributes.previous_time
         self.lost_mass += elapsed_time * self.wind_mass_loss_rate
 
@@ -251,6 +804,211 @@ class EvolvingStarsWithMassLoss(StarsWithMassLoss):
             self.previous_mass = self.mass
 
 
+class WindQuantities(object):
+    """
+        The attributes of newly created wind particles, as plain
+        quantities. wind_sphere fills this in instead of a Particles set,
+        which is expensive to build; the wind is only converted when it is
+        handed out (see SimpleWind.wind_output). Scalar attributes are
+        broadcast to all particles, like in a Particles set.
+    """
+
+    def __init__(self, number):
+        self.__dict__["number"] = number
+        self.__dict__["attributes"] = OrderedDict()
+
+    def __getattr__(self, name):
+        attributes = self.__dict__.get("attributes", {})
+        if name not in attributes:
+            raise AttributeError(name)
+        return attributes[name]
+
+    def __setattr__(self, name, value):
+        self.attributes[name] = value
+
+    def __len__(self):
+        return self.number
+
+    def attribute_names(self):
+        return list(self.attributes)
+
+    def broadcast(self, name):
+        shape = (self.number,)
+        if name in WIND_VECTOR_ATTRIBUTES:
+            shape += (3,)
+        value = self.attributes[name]
+        if quantities.is_quantity(value):
+            return value * numpy.ones(shape)
+        return numpy.broadcast_to(numpy.asarray(value), shape)
+
+    @classmethod
+    def concatenate(cls, winds):
+        winds = [wind for wind in winds if len(wind) > 0]
+        result = cls(sum(len(wind) for wind in winds))
+        if not winds:
+            return result
+        for name in winds[0].attribute_names():
+            values = [wind.broadcast(name) for wind in winds]
+            if quantities.is_quantity(values[0]):
+                unit = values[0].unit
+                values = numpy.concatenate(
+                    [value.value_in(unit) for value in values]) | unit
+            else:
+                values = numpy.concatenate(values)
+            setattr(result, name, values)
+        return result
+
+    def select(self, selection):
+        """
+            A new WindQuantities with the particles in 'selection'.
+        """
+        indices = numpy.arange(self.number)[selection]
+        result = WindQuantities(len(indices))
+        for name in self.attribute_names():
+            setattr(result, name, self.broadcast(name)[indices])
+        return result
+
+    def as_particles(self):
+        particles = Particles(self.number)
+        for name, value in self.attributes.items():
+            setattr(particles, name, value)
+        return particles
+
+
+class WindBatch(object):
+    """
+        New wind particles as plain numpy arrays ('columns'), one per
+        attribute, with the unit of every quantity in 'units' and the
+        positions relative to 'origin' (if given). With the
+        'structured' layout the columns are views into one contiguous
+        structured array ('data'), which can be written or sent as is.
+        The source column (if any) holds the keys of the stars as uint64.
+        Use as_particles only where a Particles set is really needed;
+        add_to puts the wind into a particle set without building one.
+    """
+
+    default_units = {"position": units.m,
+                     "velocity": units.m/units.s,
+                     "mass": units.kg,
+                     "u": units.m**2/units.s**2,
+                     }
+
+    def __init__(self, number, columns, batch_units, data=None, origin=None):
+        self.number = number
+        self.columns = columns
+        self.units = batch_units
+        self.data = data
+        self.origin = origin
+
+    @classmethod
+    def from_quantities(cls, wind, batch_units=None, dtype=numpy.float64,
+                        layout="structured", origin=None):
+        """
+            With a low precision dtype the positions are best stored
+            relative to an 'origin' near the wind, e.g. the center of the
+            cluster: float32 positions 1 pc from the origin are only
+            resolved to about 2e9 m.
+        """
+        batch_units = dict(cls.default_units, **(batch_units or {}))
+        values = OrderedDict((name, wind.broadcast(name))
+                             for name in wind.attribute_names())
+        if "position" in values:
+            if origin is not None:
+                values["position"] = values["position"] - origin
+            elif numpy.finfo(dtype).precision < 15:
+                warnings.warn("wind positions in {0} relative to (0, 0, 0) "
+                              "lose precision far from the origin, consider "
+                              "an output_origin".format(numpy.dtype(dtype)))
+
+        column_units = {}
+        for name, value in values.items():
+            if quantities.is_quantity(value):
+                column_units[name] = batch_units.get(name, value.unit)
+                values[name] = value.value_in(column_units[name])
+
+        if layout == "structured":
+            data = numpy.empty(len(wind), dtype=[
+                (name, dtype if name in column_units else value.dtype,
+                 value.shape[1:]) for name, value in values.items()])
+            for name, value in values.items():
+                data[name] = value
+            columns = OrderedDict((name, data[name]) for name in values)
+        elif layout == "arrays":
+            data = None
+            columns = OrderedDict(
+                (name, numpy.ascontiguousarray(
+                    value, dtype if name in column_units else value.dtype))
+                for name, value in values.items())
+        else:
+            raise AmuseException("unknown wind batch layout " + repr(layout))
+
+        return cls(len(wind), columns, column_units, data, origin)
+
+    def __len__(self):
+        return self.number
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def quantity(self, name):
+        """
+            The column as a quantity, positions relative to (0, 0, 0).
+        """
+        if name == "position" and self.origin is not None:
+            return (self.columns[name] | self.units[name]) + self.origin
+        if name in self.units:
+            return self.columns[name] | self.units[name]
+        return self.columns[name]
+
+    def as_dict(self):
+        return OrderedDict(self.columns)
+
+    def as_structured(self):
+        if self.data is not None:
+            return self.data
+        return self.from_quantities(self.as_quantities(), self.units,
+                                    layout="structured",
+                                    origin=self.origin).data
+
+    def as_quantities(self):
+        wind = WindQuantities(self.number)
+        for name in self.columns:
+            setattr(wind, name, self.quantity(name))
+        return wind
+
+    def as_particles(self):
+        return self.as_quantities().as_particles()
+
+    def store_attributes(self):
+        """
+            The attribute names and values as stored in a particle set,
+            with the vector attributes split in their components.
+        """
+        names = []
+        values = []
+        for name in self.columns:
+            if name in WIND_VECTOR_ATTRIBUTES:
+                column = self.quantity(name)
+                for i, component in enumerate(WIND_VECTOR_ATTRIBUTES[name]):
+                    names.append(component)
+                    values.append(column[:, i])
+            else:
+                names.append(name)
+                values.append(self.quantity(name))
+        return names, values
+
+    def add_to(self, particles):
+        """
+            Add the wind to 'particles' (a Particles set or the particles
+            of a code) directly from the columns.
+        """
+        if self.number == 0:
+            return
+        keys = datamodel_base.UniqueKeyGenerator.next_set_of_keys(self.number)
+        names, values = self.store_attributes()
+        particles.add_particles_to_store(keys, names, values)
+
+
 class SimpleWind(PositionGenerator):
     """
         The simple wind model creates SPH particles moving away
@@ -259,21 +1017,46 @@ class SimpleWind(PositionGenerator):
         is (far) larger then the stellar radius.
     """
 
+    particle_mass_policies = {"fixed": ParticleMassPolicy,
+                              "target_rate": TargetRateParticleMass,
+                              "radial": RadialParticleMass,
+                              }
+    output_formats = ("particles", "structured", "arrays")
+
     def __init__(self, sph_particle_mass, derive_from_evolution=False,
                  tag_gas_source=False, compensate_gravity=False, **kwargs):
+        velocity_prescription = kwargs.pop(
+            "wind_velocity_prescription",
+            "kudritzki" if derive_from_evolution else None)
+        mass_policy = kwargs.pop("particle_mass_policy", "fixed")
+        mass_policy_args = kwargs.pop("particle_mass_policy_args", {})
+        self.random_seed = kwargs.pop("random_seed", None)
+        self.output_format = kwargs.pop("output_format", "particles")
+        self.output_units = kwargs.pop("output_units", {})
+        self.output_origin = kwargs.pop("output_origin", None)
+        self.output_precision = numpy.dtype(kwargs.pop("output_precision",
+                                                       numpy.float64))
+        if self.output_format not in self.output_formats:
+            raise AmuseException("unknown output_format " +
+                                 repr(self.output_format))
         super(SimpleWind, self).__init__(**kwargs)
         self.sph_particle_mass = sph_particle_mass
+
+        if isinstance(mass_policy, str):
+            mass_policy = self.particle_mass_policies[mass_policy]
+        self.particle_mass_policy = mass_policy(**mass_policy_args)
         self.model_time = 0.0 | units.yr
 
         if derive_from_evolution:
             self.particles = EvolvingStarsWithMassLoss()
-            self.particles.add_calculated_attribute(
-                "terminal_wind_velocity", kudritzki_wind_velocity,
-                attributes_names=['mass', 'radius',
-                                  'luminosity', 'temperature'])
         else:
             self.particles = StarsWithMassLoss()
 
+        if isinstance(velocity_prescription, str):
+            velocity_prescription = wind_velocity_prescriptions[
+                velocity_prescription]
+        self.particles.set_wind_velocity_prescription(velocity_prescription)
+
         self.target_gas = self.timestep = None
         self.tag_gas_source = tag_gas_source
         self.compensate_gravity = compensate_gravity
@@ -283,24 +1066,41 @@ class SimpleWind(PositionGenerator):
         self.set_initial_wind_velocity()
 
     def set_initial_wind_velocity(self):
-        self.particles.add_calculated_attribute(
-            "initial_wind_velocity", lambda v: v,
-            attributes_names=['terminal_wind_velocity'])
+        self.particles.set_initial_wind_velocity_ratio(1.)
 
     def evolve_particles(self):
         self.particles.evolve_mass_loss(self.model_time)
 
+    def enable_stats(self, track_memory=False):
+        """
+            Start recording timings and counters of the hot paths.
+            Returns the WindStats object that collects them.
+        """
+        self.stats.stop()
+        self.stats = WindStats(track_memory)
+        return self.stats
+
+    def disable_stats(self):
+        self.stats.stop()
+        self.stats = NO_STATS
+
     def evolve_model(self, time):
         if self.has_target():
             while self.model_time <= time:
-                self.evolve_particles()
-                if self.has_new_wind_particles():
-                    wind_gas = self.create_wind_particles()
-                    self.target_gas.add_particles(wind_gas)
+                with self.stats.phase("evolve_particles"):
+                    self.evolve_particles()
+                self.release_wind()
                 self.model_time += self.timestep
         else:
             self.model_time = time
-            self.evolve_particles()
+            with self.stats.phase("evolve_particles"):
+                self.evolve_particles()
+
+    def release_wind(self):
+        if self.has_new_wind_particles():
+            wind_gas = self.create_wind_particles()
+            with self.stats.phase("add_particles"):
+                self.add_to_target(wind_gas)
 
     def set_target_gas(self, target_gas, timestep):
         self.target_gas = target_gas
@@ -309,6 +1109,28 @@ class SimpleWind(PositionGenerator):
     def has_target(self):
         return self.target_gas is not None
 
+    def add_to_target(self, wind):
+        if isinstance(wind, WindBatch):
+            wind.add_to(self.target_gas)
+        else:
+            self.target_gas.add_particles(wind)
+
+    def wind_output(self, winds):
+        """
+            Combine the WindQuantities of the stars into one batch, in the
+            output_format of the code: a Particles set ('particles'), or a
+            WindBatch of one structured array ('structured') or of separate
+            arrays ('arrays') in output_units and output_precision, with
+            the positions relative to output_origin.
+        """
+        wind = WindQuantities.concatenate(winds)
+        if self.output_format == "particles":
+            return wind.as_particles()
+        return WindBatch.from_quantities(wind, self.output_units,
+                                         self.output_precision,
+                                         layout=self.output_format,
+                                         origin=self.output_origin)
+
     def set_global_mu(self, Y=0.25, Z=0.02, x_ion=0.1):
         """
             Set the global value of mu used to create stellar wind.
@@ -334,8 +1156,8 @@ class SimpleWind(PositionGenerator):
 
         return 0.5 * star.terminal_wind_velocity**2
 
-    def wind_sphere(self, star, Ngas):
-        wind = Particles(Ngas)
+    def wind_sphere(self, star, Ngas, random=None):
+        wind = WindQuantities(Ngas)
 
         wind_velocity = star.initial_wind_velocity
 
@@ -343,7 +1165,7 @@ class SimpleWind(PositionGenerator):
             self.model_time - star.wind_release_time)
 
         wind.position, direction = self.generate_positions(
-            Ngas, star.radius, outer_wind_distance)
+            Ngas, star.radius, outer_wind_distance, random=random)
 
         if self.compensate_gravity:
             r = wind.position.lengths()
@@ -355,13 +1177,59 @@ class SimpleWind(PositionGenerator):
 
         return wind
 
-    def create_wind_particles_for_one_star(self, star):
-        Ngas = int(star.lost_mass/self.sph_particle_mass)
-        star.lost_mass -= Ngas * self.sph_particle_mass
-
-        wind = self.wind_sphere(star, Ngas)
+    def particle_mass(self, stars):
+        """
+            The SPH particle mass for a star (or a set of stars),
+            as decided by the particle mass policy.
+        """
+        return self.particle_mass_policy.particle_mass(stars, self)
 
-        wind.mass = self.sph_particle_mass
+    def random_state_for(self, star):
+        """
+            A random generator seeded by random_seed, the star and the model
+            time, so the wind of a star does not depend on the order in
+            which, or the process on which, the stars are handled.
+        """
+        time = numpy.float64(self.model_time.value_in(units.yr))
+        time = int(time.view(numpy.uint64))
+        key = int(star.key)
+        return numpy.random.RandomState([self.random_seed,
+                                         key & 0xffffffff, key >> 32,
+                                         time & 0xffffffff, time >> 32])
+
+    def random_state_for_chunk(self, start):
+        """
+            The random generator of the steady state chunk that starts with
+            particle 'start', seeded by random_seed if it is given.
+        """
+        if self.random_seed is None:
+            return self.random
+        return numpy.random.RandomState([self.random_seed,
+                                         start & 0xffffffff, start >> 32])
+
+    def create_wind_particles_for_one_star(self, star, particle_mass=None):
+        random = self.random
+        if self.random_seed is not None:
+            random = self.random_state_for(star)
+
+        if particle_mass is None:
+            particle_mass = self.particle_mass(star)
+        Ngas = int(star.lost_mass/particle_mass)
+
+        with self.stats.phase("wind_sphere"):
+            wind = self.wind_sphere(star, Ngas, random)
+
+        keep = self.particle_mass_policy.keep_particles(wind.position, star,
+                                                        random)
+        if keep is not None:
+            wind = wind.select(keep)
+        if len(wind) == 0:
+            return wind
+        star.lost_mass -= Ngas * particle_mass
+        self.stats.emit(star.key, len(wind))
+
+        wind.mass = self.particle_mass_policy.particle_masses(
+            wind.position, star, Ngas * particle_mass / len(wind))
         wind.u = self.internal_energy_formula(star, wind)
         wind.position += star.position
         wind.velocity += star.velocity
@@ -372,18 +1240,28 @@ class SimpleWind(PositionGenerator):
         return wind
 
     def create_wind_particles(self):
-        wind = Particles(0)
+        with self.stats.phase("create_wind_particles"):
+            return self.wind_output(
+                [wind for i, wind in self.wind_per_star(self.particles)])
 
-        for star in self.particles:
-            if star.lost_mass > self.sph_particle_mass:
-                new_particles = self.create_wind_particles_for_one_star(star)
-                wind.add_particles(new_particles)
+    def wind_per_star(self, stars):
+        """
+            Yields the index in 'stars' and the WindQuantities of every
+            star that has lost enough mass.
+        """
+        masses = numpy.ones(len(stars)) * self.particle_mass(stars)
+        for i, star in enumerate(stars):
+            if star.lost_mass > masses[i]:
+                new_particles = self.create_wind_particles_for_one_star(
+                    star, masses[i])
+                if len(new_particles) == 0:
+                    continue
                 star.wind_release_time = self.model_time
-
-        return wind
+                yield i, new_particles
 
     def has_new_wind_particles(self):
-        return self.particles.lost_mass.max() > self.sph_particle_mass
+        return (self.particles.lost_mass
+                > self.particle_mass(self.particles)).any()
 
     def create_initial_wind(self, number=None, time=None, check_length=True):
         """
@@ -397,26 +1275,172 @@ class SimpleWind(PositionGenerator):
             particles is far larger then the number of stars
         """
         if number is not None:
-            required_mass = number * self.sph_particle_mass
-            total_mass_loss = self.particles.wind_mass_loss_rate.sum()
-            time = 1.0 * required_mass/total_mass_loss
+            particle_rate = (self.particles.wind_mass_loss_rate
+                             / self.particle_mass(self.particles)).sum()
+            time = 1.0 * number/particle_rate
         self.model_time = time
         self.particles.evolve_mass_loss(self.model_time)
 
         if self.has_new_wind_particles():
             wind_gas = self.create_wind_particles()
             if self.has_target():
-                self.target_gas.add_particles(wind_gas)
+                self.add_to_target(wind_gas)
         elif check_length:
             raise AmuseException("create_initial_wind time was too small to"
                                  "create any particles.")
         else:
-            wind_gas = Particles()
+            wind_gas = self.wind_output([])
 
         self.reset()
 
         return wind_gas
 
+    def steady_state_wind(self, number=None, time=None, radius=None,
+                          chunk_size=100000, table_size=256):
+        """
+            Samples the wind of all stars directly from the steady state
+            density profile rho(r) = m_dot / (4 pi r**2 v(r)), as if it has
+            been blowing for a while, without evolving the stars. This also
+            works when the mass loss is derived from stellar evolution.
+            Specify one of:
+                number: the total number of particles
+                time: how long the wind has been blowing
+                radius: the outer radius of the wind of every star
+            The particles are yielded in chunks of at most chunk_size, in
+            the output_format of the code. Every particle of a star gets
+            the same mass. With a random_seed every chunk is drawn from its
+            own seeded generator, so the result is reproducible and the
+            same on every MPI rank.
+        """
+        self.particles.update_wind_velocities()
+        stars = self.particles
+        m_dot = stars.wind_mass_loss_rate.value_in(units.kg/units.s)
+        mass = numpy.ones(len(stars)) * self.particle_mass(stars)
+        mass = mass.value_in(units.kg)
+
+        if number is not None:
+            time = (1.0 * number / (m_dot / mass).sum()) | units.s
+        if time is not None:
+            tau = numpy.ones(len(stars)) * time.value_in(units.s)
+            r_out = None
+        elif radius is not None:
+            r_out = (numpy.ones(len(stars)) * radius).value_in(units.m)
+            tau = self.travel_times(stars, r_out, chunk_size, table_size)
+        else:
+            raise AmuseException("steady_state_wind needs a number, time or"
+                                 " radius")
+
+        counts = (m_dot * tau / mass).astype(int)
+        ends = numpy.cumsum(counts)
+        total = ends[-1] if len(ends) else 0
+
+        for start in range(0, total, chunk_size):
+            particles = numpy.arange(start, min(start + chunk_size, total))
+            indices = numpy.searchsorted(ends, particles, side="right")
+            yield self.steady_state_chunk(stars, indices, mass, tau, r_out,
+                                          table_size,
+                                          self.random_state_for_chunk(start))
+
+    def create_steady_state_wind(self, *args, **kwargs):
+        """
+            Adds the particles of steady_state_wind to the target gas, one
+            chunk at a time, and returns the number of particles created.
+        """
+        if not self.has_target():
+            raise AmuseException("create_steady_state_wind needs a target gas,"
+                                 " use steady_state_wind instead")
+        number = 0
+        for wind in self.steady_state_wind(*args, **kwargs):
+            self.add_to_target(wind)
+            number += len(wind)
+        return number
+
+    def steady_state_velocity(self, stars, radii):
+        """
+            The wind speed at 'radii' for the StarArrays 'stars'.
+        """
+        velocity = stars.initial_wind_velocity
+        if self.compensate_gravity:
+            return (velocity**2 + 2. * constants.G * stars.mass / radii).sqrt()
+        return velocity * numpy.ones(radii.shape)
+
+    def maximum_wind_velocity(self, stars):
+        return self.steady_state_velocity(stars, stars.radius)
+
+    def steady_state_internal_energy(self, stars, wind):
+        return self.internal_energy_formula(stars, wind)
+
+    def travel_time_table(self, stars, indices, r_out, table_size):
+        """
+            Radii between the surface and r_out of the stars[indices], and
+            the time it takes the wind to get there, in SI units.
+        """
+        star_arrays = StarArrays(stars, numpy.repeat(indices, table_size))
+
+        def velocity(radii):
+            speed = self.steady_state_velocity(star_arrays,
+                                               radii.ravel() | units.m)
+            return speed.value_in(units.m/units.s).reshape(radii.shape)
+
+        return travel_time_table(stars.radius.value_in(units.m)[indices],
+                                 r_out, table_size, velocity)
+
+    def travel_times(self, stars, r_out, chunk_size, table_size):
+        """
+            The travel time from the surface to r_out of every star.
+        """
+        tau = numpy.zeros(len(stars))
+        block = max(1, chunk_size // table_size)
+        for start in range(0, len(stars), block):
+            indices = numpy.arange(start, min(start + block, len(stars)))
+            tau[indices] = self.travel_time_table(
+                stars, indices, r_out[indices], table_size)[1][:, -1]
+        return tau
+
+    def steady_state_radii(self, stars, unique, rows, quantiles, tau, r_out,
+                           table_size):
+        """
+            Distances of the particles of stars[unique[rows]], such that
+            their travel times are evenly spread over tau.
+        """
+        if r_out is None:
+            v_max = self.maximum_wind_velocity(StarArrays(stars, unique))
+            r_out = (stars.radius[unique] + v_max * (tau | units.s))
+            r_out = r_out.value_in(units.m)
+
+        radii, times = self.travel_time_table(stars, unique, r_out, table_size)
+        x = quantiles * tau[rows] / times[rows, -1]
+        return interpolate_rows(x, rows, times / times[:, -1:], radii)
+
+    def steady_state_chunk(self, stars, indices, mass, tau, r_out, table_size,
+                           random):
+        unique, rows = numpy.unique(indices, return_inverse=True)
+        star_arrays = StarArrays(stars, indices)
+
+        quantiles = random.uniform(0., 1., len(indices))
+        distance = self.steady_state_radii(
+            stars, unique, rows, quantiles, tau[unique],
+            None if r_out is None else r_out[unique], table_size)
+
+        direction = wind_kernels().unit_vectors(
+            self.uniform_hollow_sphere(len(indices), 0., random))[0]
+        speed = self.steady_state_velocity(star_arrays, distance | units.m)
+
+        wind = WindQuantities(len(indices))
+        wind.position = wind_kernels().scale_vectors(
+            direction, distance) | units.m
+        wind.velocity = wind_kernels().scale_vectors(
+            direction, speed.value_in(units.m/units.s)) | units.m/units.s
+        wind.mass = mass[indices] | units.kg
+        wind.u = self.steady_state_internal_energy(star_arrays, wind)
+        wind.position += star_arrays.position
+        wind.velocity += star_arrays.velocity
+
+        if self.tag_gas_source:
+            wind.source = star_arrays.key
+
+        return self.wind_output([wind])
+
     def reset(self):
         self.particles.reset()
         self.model_time = 0.0 | units.yr
@@ -432,26 +1456,99 @@ class SimpleWind(PositionGenerator):
         return [0, 0, 0] | units.J
 
 
+class StarArrays(object):
+    """
+        Per-point view of the attributes of a set of stars, used to evaluate
+        the profiles of many stars in one vectorized call. Element i of every
+        attribute belongs to star stars[indices[i]]. Attributes are read from
+        the star set (and indexed) on first use only.
+    """
+
+    def __init__(self, stars, indices=None):
+        self.stars = stars
+        self.indices = indices
+
+    def __getattr__(self, name):
+        if name in ("stars", "indices") or name.startswith("__"):
+            raise AttributeError(name)
+        value = getattr(self.stars, name)
+        if self.indices is not None:
+            value = value[self.indices]
+        setattr(self, name, value)
+        return value
+
+    def __len__(self):
+        return len(self.star_indices())
+
+    def star_indices(self):
+        if self.indices is None:
+            return numpy.arange(len(self.stars))
+        return self.indices
+
+    def __getitem__(self, selection):
+        subset = StarArrays(self.stars, self.star_indices()[selection])
+        for name, value in self.__dict__.items():
+            if name not in ("stars", "indices"):
+                setattr(subset, name, value[selection])
+        return subset
+
+
 class AccelerationFunction(object):
     """
     Abstact superclass of all acceleration functions.
     It numerically derives everything from using acceleration_from_radius
     Overwrite as many of these functions with analitic solutions as possible.
+
+    The *_batched methods evaluate the profiles of many stars at once, given
+    a star set and the star index of every point. Methods listed in
+    vectorized_methods are evaluated in one call on a StarArrays view, the
+    others fall back to one call per star. radius_from_time and
+    radius_from_number are interpolated in a travel time table instead,
+    when velocity_from_radius is vectorized.
     """
 
-    def __init__(self):
-        try:
-            from scipy import integrate, optimize
-            self.quad = integrate.quad
-            # self.root = optimize.root
-            self.brentq = optimize.brentq
-        except ImportError:
-            self.quad = self.unsupported
-            # self.root = self.unsupported
-            self.brentq = self.unsupported
+    vectorized_methods = ()
+    table_size = 1000
 
-    def unsupported(self, *args, **kwargs):
-        raise AmuseException("Importing SciPy has failed")
+    def quad(self, *args, **kwargs):
+        return scipy_function("integrate", "quad")(*args, **kwargs)
+
+    def brentq(self, *args, **kwargs):
+        return scipy_function("optimize", "brentq")(*args, **kwargs)
+
+    stats = NO_STATS
+
+    def enable_stats(self, stats):
+        """
+            Count the quad and brentq calls and the integrand evaluations,
+            and time them, in 'stats'.
+        """
+        self.disable_stats()
+        self.stats = stats
+        quad, brentq = self.quad, self.brentq
+
+        def counted(function):
+            def counted_function(*args):
+                stats.count("integrand_evaluations")
+                return function(*args)
+            return counted_function
+
+        def counted_quad(function, *args, **kwargs):
+            stats.count("quad_calls")
+            with stats.phase("quad"):
+                return quad(counted(function), *args, **kwargs)
+
+        def counted_brentq(function, *args, **kwargs):
+            stats.count("brentq_calls")
+            with stats.phase("brentq"):
+                return brentq(function, *args, **kwargs)
+
+        self.quad, self.brentq = counted_quad, counted_brentq
+
+    def disable_stats(self):
+        if self.stats.enabled:
+            del self.quad, self.brentq
+        self.stats = NO_STATS
 
     def acceleration_from_radius(self, radius, star):
         """
@@ -531,8 +1628,104 @@ class AccelerationFunction(object):
 
         return radius | units.RSun
 
+    def acceleration_from_radius_batched(self, radius, stars, indices):
+        return self.batched("acceleration_from_radius", stars, indices,
+                            radius)
+
+    def velocity_from_radius_batched(self, radius, stars, indices):
+        return self.batched("velocity_from_radius", stars, indices, radius)
+
+    def radius_from_time_batched(self, time, stars, indices):
+        if ("radius_from_time" in self.vectorized_methods
+                or "velocity_from_radius" not in self.vectorized_methods):
+            return self.batched("radius_from_time", stars, indices, time)
+
+        unique, rows = numpy.unique(indices, return_inverse=True)
+        t = time.value_in(units.s) * numpy.ones(len(indices))
+        t_max = numpy.zeros(len(unique))
+        numpy.maximum.at(t_max, rows, t)
+
+        speed = units.m/units.s
+        v_max = numpy.maximum(
+            stars.initial_wind_velocity.value_in(speed)[unique],
+            stars.terminal_wind_velocity.value_in(speed)[unique])
+        r_star = stars.radius.value_in(units.m)[unique]
+        radii, times = self.travel_time_table(
+            stars, unique, r_star + 1.01 * v_max * t_max)
+
+        total = numpy.where(times[:, -1] > 0, times[:, -1], 1.)
+        return interpolate_rows(t / total[rows], rows,
+                                times / total[:, None], radii) | units.m
+
+    def radius_from_number_batched(self, numbers, max_radius, stars,
+                                   indices):
+        """
+            max_radius is given per point, but has to be the same for all
+            points of a star.
+        """
+        if "radius_from_number" in self.vectorized_methods:
+            return self.batched("radius_from_number", stars, indices,
+                                numbers, max_radius)
+
+        if "velocity_from_radius" in self.vectorized_methods:
+            unique, first, rows = numpy.unique(
+                indices, return_index=True, return_inverse=True)
+            r_out = max_radius.value_in(units.m)[first]
+            radii, times = self.travel_time_table(stars, unique, r_out)
+            return interpolate_rows(numbers, rows, times / times[:, -1:],
+                                    radii) | units.m
+
+        def one_star(numbers, max_radius, star):
+            return self.radius_from_number(numbers, max_radius[0], star)
+
+        return self.per_star(one_star, stars, indices, (numbers, max_radius))
+
+    def travel_time_table(self, stars, indices, r_out):
+        """
+            Radii between the surface and r_out of the stars[indices], and
+            the time it takes the wind to get there, in SI units. Used
+            instead of quad and brentq by the batched radius_from_time and
+            radius_from_number, when velocity_from_radius is vectorized.
+        """
+        star_arrays = StarArrays(stars, numpy.repeat(indices, self.table_size))
+
+        def velocity(radii):
+            speed = self.velocity_from_radius(radii.ravel() | units.m,
+                                              star_arrays)
+            return speed.value_in(units.m/units.s).reshape(radii.shape)
+
+        return travel_time_table(stars.radius.value_in(units.m)[indices],
+                                 r_out, self.table_size, velocity)
+
+    def batched(self, name, stars, indices, *per_point):
+        """
+            Call method 'name' with the per point arrays in 'per_point'
+            for the stars stars[indices].
+        """
+        method = getattr(self, name)
+        if name in self.vectorized_methods:
+            return method(*(per_point + (StarArrays(stars, indices),)))
+        return self.per_star(method, stars, indices, per_point)
+
+    def per_star(self, method, stars, indices, per_point):
+        """
+            Call 'method' once per star, with its part of the per point
+            arrays.
+        """
+        result = None
+        for i in numpy.unique(indices):
+            selection = indices == i
+            args = [values[selection] for values in per_point]
+            values = method(*(args + [stars[i]]))
+            if result is None:
+                result = numpy.zeros(len(indices)) | values.unit
+            result[selection] = values
+        return result
+
     def fix_cutoffs(self, test, value, star, default):
         if hasattr(value, "__len__"):
+            if hasattr(default, "__len__"):
+                default = default[test]
             value[test] = default
         elif test:
             value = default
@@ -552,6 +1745,9 @@ class ConstantVelocityAcceleration(AccelerationFunction):
         A very basic "acceleration" function that ensures a constant velocity,
     """
 
+    vectorized_methods = ("acceleration_from_radius", "velocity_from_radius",
+                          "radius_from_time", "radius_from_number")
+
     def acceleration_from_radius(self, radius, star):
         return numpy.zeros_like(radius, dtype=float) | units.m/units.s**2
 
@@ -568,6 +1764,8 @@ class ConstantVelocityAcceleration(AccelerationFunction):
 
 
 class RSquaredAcceleration(AccelerationFunction):
+    vectorized_methods = ("acceleration_from_radius", "velocity_from_radius")
+
     def scaling(self, star):
         return 0.5 * ((star.terminal_wind_velocity**2
                        - star.initial_wind_velocity**2)
@@ -584,6 +1782,8 @@ class RSquaredAcceleration(AccelerationFunction):
 
 
 class DelayedRSquaredAcceleration(AccelerationFunction):
+    vectorized_methods = ("acceleration_from_radius", "velocity_from_radius")
+
     def scaling(self, star):
         return 0.5 * ((star.terminal_wind_velocity**2
                        - star.initial_wind_velocity**2)
@@ -621,15 +1821,18 @@ class NowotnyAcceleration(AccelerationFunction):
 class VelocityLawAcceleration(AccelerationFunction):
     """ Following Walter Maciel 2005 """
 
+    vectorized_methods = ("acceleration_from_radius", "velocity_from_radius")
+
     def __init__(self, alpha=4):
+        super(VelocityLawAcceleration, self).__init__()
         self.alpha = alpha
 
     def acceleration_from_radius(self, r, star):
         v_start = star.initial_wind_velocity
         v_end = star.terminal_wind_velocity
-        dvdr = (2 * star.radius * (1 - star.radius / r)
+        dvdr = (self.alpha * star.radius * (1 - star.radius / r)**(self.alpha-1)
                 * (v_end - v_start) / r**2)
-        return dvdr * self.velocity_from_radius(self, r, star)
+        return dvdr * self.velocity_from_radius(r, star)
 
     def velocity_from_radius(self, r, star):
         v_start = star.initial_wind_velocity
@@ -640,35 +1843,32 @@ class VelocityLawAcceleration(AccelerationFunction):
 class LogisticVelocityAcceleration(AccelerationFunction):
     """ The velocity follows the Logistic (Sigmoid) Function """
 
+    vectorized_methods = ("acceleration_from_radius", "velocity_from_radius")
+
     def __init__(self, steepness=10, r_mid=None):
         super(LogisticVelocityAcceleration, self).__init__()
         self.steepness = steepness
         self.r_mid = r_mid
 
-    def short(self, r, star):
-        v_init = star.initial_wind_velocity
-        v_end = star.terminal_wind_velocity
-
+    def profile(self, r, star):
         if self.r_mid is None:
             r_mid = (star.acc_cutoff + star.radius)/2.
         else:
             r_mid = self.r_mid * star.radius
-        exp = numpy.exp(-self.steepness * (r - r_mid) / (r_mid))
 
-        return v_init, v_end, r_mid, exp
+        v, acc = wind_kernels().logistic_profile(
+            r.value_in(units.m),
+            star.initial_wind_velocity.value_in(units.m/units.s),
+            star.terminal_wind_velocity.value_in(units.m/units.s),
+            r_mid.value_in(units.m), self.steepness,
+            star.acc_cutoff.value_in(units.m))
+        return v | units.m/units.s, acc | units.m/units.s**2
 
     def acceleration_from_radius(self, r, star):
-        v_init, v_end, r_mid, exp = self.short(r, star)
-        dvdr = (self.steepness * (v_end - v_init) * exp
-                / (r_mid * (1. + exp)**2))
-        v = v_init + (v_end - v_init) / (1. + exp)
-        acc = v * dvdr
-        return self.fix_acc_cutoff(r, acc, star)
+        return self.profile(r, star)[1]
 
     def velocity_from_radius(self, r, star):
-        v_init, v_end, r_mid, exp = self.short(r, star)
-        v = v_init + (v_end - v_init) / (1. + exp)
-        return self.fix_v_cutoff(r, v, star)
+        return self.profile(r, star)[0]
 
 
 class AcceleratingWind(SimpleWind):
@@ -700,10 +1900,19 @@ class AcceleratingWind(SimpleWind):
         self.add_atmospheric_pressure = kwargs.pop("add_atmospheric_pressure",
                                                    False)
         self.staging_radius = kwargs.pop("staging_radius", None)
+        self.gravity_cache_size = kwargs.pop("gravity_cache_size", 8)
+        self.potential_table_size = kwargs.pop("potential_table_size", 1000)
+        self.gravity_chunk_size = kwargs.pop("gravity_chunk_size", 10**6)
+        self.timestep_table_size = kwargs.pop("timestep_table_size", 256)
 
         super(AcceleratingWind, self).__init__(*args, **kwargs)
 
-        if isinstance(acc_func, basestring):
+        self.gravity_cache = OrderedDict()
+        self.potential_tables = None
+        self.timestep_tables = None
+        self.cached_star_state = None
+
+        if isinstance(acc_func, str):
             acc_func = self.acc_functions[acc_func]
 
         self.acc_function = acc_func(**acc_func_args)
@@ -725,9 +1934,7 @@ class AcceleratingWind(SimpleWind):
 
     def set_initial_wind_velocity(self):
         if self.v_init_ratio is not None:
-            self.particles.add_calculated_attribute(
-                "initial_wind_velocity", lambda v: self.v_init_ratio * v,
-                attributes_names=['terminal_wind_velocity'])
+            self.particles.set_initial_wind_velocity_ratio(self.v_init_ratio)
 
     def scaled_u_from_T(self, star, wind=None):
         """
@@ -748,8 +1955,8 @@ class AcceleratingWind(SimpleWind):
         u = rho_0**(1 - self.gamma) * rho**(self.gamma - 1) * u_0
         return u
 
-    def wind_sphere(self, star, Ngas):
-        wind = Particles(Ngas)
+    def wind_sphere(self, star, Ngas, random=None):
+        wind = WindQuantities(Ngas)
 
         dt = (self.model_time - star.wind_release_time)
         if self.critical_time_step is None or dt > self.critical_time_step:
@@ -757,119 +1964,446 @@ class AcceleratingWind(SimpleWind):
         else:
             acc_function = ConstantVelocityAcceleration()
 
-        outer_wind_distance = acc_function.radius_from_time(dt, star)
+        # the batched profiles avoid quad and brentq per particle
+        stars = star.as_set()
+
+        def radius_from_number(numbers, max_radius, star):
+            indices = numpy.zeros(len(numbers), dtype=int)
+            return acc_function.radius_from_number_batched(
+                numbers, max_radius * numpy.ones(len(numbers)), stars,
+                indices)
+
+        outer_wind_distance = acc_function.radius_from_time_batched(
+            dt, stars, numpy.zeros(1, dtype=int))[0]
 
         wind.position, direction = self.generate_positions(
-            Ngas, star.radius, outer_wind_distance,
-            acc_function.radius_from_number, star=star)
+            Ngas, star.radius, outer_wind_distance, radius_from_number,
+            star=star, random=random)
 
         velocities = acc_function.velocity_from_radius(
             wind.position.lengths(), star)
-        wind.velocity = direction * self.as_three_vector(velocities)
+        wind.velocity = wind_kernels().scale_vectors(
+            direction, velocities.value_in(units.m/units.s)) | units.m/units.s
 
         return wind
 
-    def pressure_accelerations(self, indices, radii, star):
-        v = self.acc_function.velocity_from_radius(radii, star)
-        a = self.acc_function.acceleration_from_radius(radii, star)
-        u = self.internal_energy_formula(star)
-        m_dot = star.wind_mass_loss_rate
-        v_init = star.initial_wind_velocity
-
-        rho = m_dot / (4 * numpy.pi * v * radii**2)
-        rho_init = m_dot / (4. * numpy.pi * v_init * star.radius**2)
+    def profile(self, name, radii, star):
+        """
+            Evaluate acc_function.<name> for one star, or batched when 'star'
+            is a StarArrays view of many stars.
+        """
+        if isinstance(star, StarArrays):
+            return self.acc_function.batched(name, star.stars,
+                                             star.star_indices(), radii)
+        return getattr(self.acc_function, name)(radii, star)
 
-        k = (self.gamma-1) * rho_init**(1-self.gamma) * u
+    def select(self, star, selection):
+        if isinstance(star, StarArrays):
+            return star[selection]
+        return star
 
-        dvdr = a/v
+    def steady_state_velocity(self, stars, radii):
+        return self.profile("velocity_from_radius", radii, stars)
 
-        acceleration = self.gamma * k * rho**(self.gamma-1) * (2./radii + dvdr/v)
+    def maximum_wind_velocity(self, stars):
+        unit = units.m/units.s
+        return numpy.maximum(stars.initial_wind_velocity.value_in(unit),
+                             stars.terminal_wind_velocity.value_in(unit)) | unit
 
-        return acceleration
+    def pressure_accelerations(self, indices, radii, star):
+        v = self.profile("velocity_from_radius", radii, star)
+        a = self.profile("acceleration_from_radius", radii, star)
+        u = self.internal_energy_formula(star)
 
-    def radial_velocities(self, gas, star):
-        rad_velocity = [] | units.ms
-        pos_vel = zip(gas.position-star.position, gas.velocity-star.velocity)
-        for pos, vel in pos_vel:
-            rad_direction = pos/pos.length()
-            scalar_projection = vel.dot(rad_direction)
+        acceleration = wind_kernels().pressure_acceleration(
+            radii.value_in(units.m), v.value_in(units.m/units.s),
+            a.value_in(units.m/units.s**2), u.value_in(units.m**2/units.s**2),
+            star.wind_mass_loss_rate.value_in(units.kg/units.s),
+            star.initial_wind_velocity.value_in(units.m/units.s),
+            star.radius.value_in(units.m), self.gamma)
 
-            rad_velocity.append(scalar_projection)
+        return acceleration | units.m/units.s**2
 
-        return rad_velocity
+    def radial_velocities(self, gas, star):
+        position = gas.position - star.position
+        velocity = gas.velocity - star.velocity
+        return (position * velocity).sum(axis=1) / position.lengths()
 
     def staging_accelerations(self, indices, radii, star):
         particles = self.the_target_gas[indices]
         v_now = self.radial_velocities(particles, star)
-        v_target = self.acc_function.velocity_from_radius(radii, star)
+        v_target = self.profile("velocity_from_radius", radii, star)
         dt = self.bridge_time_step
         acc = (v_target - v_now) / dt
         return acc
 
     def atmospheric_pressure(self, indices, radii, star):
-        v = self.acc_function.velocity_from_radius(radii, star)
+        v = self.profile("velocity_from_radius", radii, star)
         g = constants.G * star.mass/star.radius**2
-        h = (constants.kB * star.temperature)/(g*star.mu)
-        rho = star.wind_mass_loss_rate / (4 * numpy.pi * v * radii**2)
-        s_v = star.initial_wind_velocity
-        s_r = star.radius
-        rho_surface = star.wind_mass_loss_rate / (4 * numpy.pi * s_v * s_r**2)
-
-        pressure_surface = (rho_surface * constants.kB
-                            * star.temperature)/star.mu
-        acceleration = (pressure_surface / (rho * h)
-                        * numpy.exp(-(radii-star.radius)/h))
-        return acceleration
+
+        acceleration = wind_kernels().atmospheric_acceleration(
+            radii.value_in(units.m), v.value_in(units.m/units.s),
+            star.wind_mass_loss_rate.value_in(units.kg/units.s),
+            star.initial_wind_velocity.value_in(units.m/units.s),
+            star.radius.value_in(units.m), g.value_in(units.m/units.s**2),
+            star.temperature.value_in(units.K), star.mu.value_in(units.kg))
+        return acceleration | units.m/units.s**2
+
+    def evolve_particles(self):
+        super(AcceleratingWind, self).evolve_particles()
+        self.invalidate_gravity_cache()
+
+    def enable_stats(self, track_memory=False):
+        stats = super(AcceleratingWind, self).enable_stats(track_memory)
+        self.acc_function.enable_stats(stats)
+        return stats
+
+    def disable_stats(self):
+        super(AcceleratingWind, self).disable_stats()
+        self.acc_function.disable_stats()
 
     def acceleration(self, star, radii):
+        accelerations = self.conservative_acceleration(star, radii)
+
+        if self.staging_radius is not None:
+            i_stag = radii < star.radius * self.staging_radius
+            if i_stag.any():
+                accelerations[i_stag] += self.staging_accelerations(
+                    i_stag, radii[i_stag], star)
+
+        return accelerations
+
+    def conservative_acceleration(self, star, radii):
+        """
+            All accelerations that only depend on the distance to the star,
+            i.e. everything except the velocity dependent staging term.
+            'star' can be a single star or a StarArrays view with one star
+            per radius.
+        """
         accelerations = numpy.zeros(radii.shape) | units.m/units.s**2
 
         i_acc = ((radii >= star.radius) & (radii < star.acc_cutoff))
         i_all = radii < star.acc_cutoff
         i_all_grav = radii < star.grav_acc_cutoff
 
-        accelerations[i_acc] += self.acc_function.acceleration_from_radius(
-            radii[i_acc], star)
+        if i_acc.any():
+            accelerations[i_acc] += self.profile(
+                "acceleration_from_radius", radii[i_acc],
+                self.select(star, i_acc))
 
         if self.compensate_pressure:
             if self.staging_radius is not None:
                 i_pres = radii > star.radius * self.staging_radius
             else:
                 i_pres = i_all
-            accelerations[i_pres] -= self.pressure_accelerations(
-                i_pres, radii[i_pres], star)
+            if i_pres.any():
+                accelerations[i_pres] -= self.pressure_accelerations(
+                    i_pres, radii[i_pres], self.select(star, i_pres))
 
         if self.compensate_gravity:
             r = radii[i_all_grav]
-            accelerations[i_all_grav] += constants.G * star.mass / r**2
+            mass = self.select(star, i_all_grav).mass
+            accelerations[i_all_grav] += constants.G * mass / r**2
 
         if self.add_atmospheric_pressure:
             i_star = radii < star.radius
-            acc_atm = self.atmospheric_pressure(i_star, radii[i_star], star)
-            accelerations[i_star] += acc_atm
-
-        if self.staging_radius is not None:
-            i_stag = radii < star.radius * self.staging_radius
-            if i_stag.any():
-                accelerations[i_stag] += self.staging_accelerations(
-                    i_stag, radii[i_stag], star)
+            if i_star.any():
+                acc_atm = self.atmospheric_pressure(
+                    i_star, radii[i_star], self.select(star, i_star))
+                accelerations[i_star] += acc_atm
 
         return accelerations
 
+    def invalidate_gravity_cache(self):
+        self.gravity_cache.clear()
+        self.potential_tables = None
+        self.timestep_tables = None
+        self.cached_star_state = None
+
+    def state_attributes(self):
+        """
+            The star attributes the accelerations depend on, with the unit
+            they are compared in (None to compare the plain numbers).
+            Temperature and mu only matter to the pressure terms. The
+            inputs of the wind velocity prescription are included, since
+            the wind velocities are derived from them.
+        """
+        speed = units.m/units.s
+        attributes = [("x", units.m), ("y", units.m), ("z", units.m),
+                      ("radius", units.m), ("mass", units.kg),
+                      ("wind_mass_loss_rate", units.kg/units.s),
+                      ("terminal_wind_velocity", speed),
+                      ("initial_wind_velocity", speed)]
+        if self.compensate_pressure or self.add_atmospheric_pressure:
+            attributes += [("temperature", units.K), ("mu", units.kg)]
+        prescription = (self.particles.collection_attributes.
+                        wind_velocity_prescription)
+        if prescription is not None:
+            attributes += [(name, None) for name in prescription[1]]
+        return attributes
+
+    def star_state(self):
+        """
+            A cheap fingerprint of everything in the stars that determines
+            the accelerations. Cached results are dropped when it changes.
+            Attributes the stars do not have are skipped.
+        """
+        stars = self.particles
+        defined = stars.get_attribute_names_defined_in_store()
+        digest = hashlib.sha1()
+        for name, unit in self.state_attributes():
+            if name not in defined:
+                continue
+            values = getattr(stars, name)
+            if unit is not None:
+                values = values.value_in(unit)
+            elif quantities.is_quantity(values):
+                values = values.number
+            digest.update(name.encode())
+            digest.update(numpy.ascontiguousarray(values).tobytes())
+        return digest.digest()
+
+    def check_cache_state(self):
+        """
+            When the stars have changed since the last call, refresh their
+            wind velocities (which may be derived from the changed
+            attributes) and drop the cached results.
+        """
+        state = self.star_state()
+        if state != self.cached_star_state:
+            self.particles.update_wind_velocities()
+            self.invalidate_gravity_cache()
+            self.cached_star_state = self.star_state()
+
+    def gravity_cache_key(self, x, y, z):
+        digest = hashlib.sha1()
+        for values in [x, y, z]:
+            values = numpy.ascontiguousarray(values.value_in(units.m))
+            digest.update(values.tobytes())
+        return digest.digest()
+
     def get_gravity_at_point(self, eps, x, y, z):
-        total_acceleration = (
-            numpy.zeros(shape=(len(x), 3)) | units.m/units.s**2)
-
-        positions = quantities.as_vector_quantity(
-            numpy.transpose([x, y, z]))
-        for star in self.particles:
-            relative_position = positions - star.position
-            distance = relative_position.lengths()
-            acceleration = self.acceleration(star, distance)
-            direction = relative_position / self.as_three_vector(distance)
+        """
+            The results are kept in a small LRU cache, because bridge asks
+            for the same points in the first and last kick. Caching is
+            disabled with a staging_radius, which depends on the gas velocity.
+        """
+        with self.stats.phase("get_gravity_at_point"):
+            return self.cached_gravity_at_point(eps, x, y, z)
+
+    def cached_gravity_at_point(self, eps, x, y, z):
+        self.check_cache_state()
+        if self.gravity_cache_size <= 0 or self.staging_radius is not None:
+            return self.calculate_gravity_at_point(eps, x, y, z)
+
+        key = self.gravity_cache_key(x, y, z)
+        if key in self.gravity_cache:
+            self.stats.count("gravity_cache_hits")
+            self.gravity_cache[key] = self.gravity_cache.pop(key)
+            return self.gravity_cache[key].copy()
+
+        self.stats.count("gravity_cache_misses")
+        result = self.calculate_gravity_at_point(eps, x, y, z)
+        self.gravity_cache[key] = result
+        while len(self.gravity_cache) > self.gravity_cache_size:
+            self.gravity_cache.popitem(last=False)
+
+        return result.copy()
+
+    def potential_table(self):
+        """
+            Tabulate the potential of the (conservative) acceleration profile
+            of all stars, phi(r) = integral from r to r_out of a(r) dr, where
+            r_out is the largest acceleration cutoff of the star.
+        """
+        if self.potential_tables is not None:
+            return self.potential_tables
+
+        stars = self.particles
+        r_in = 1e-3 * stars.radius.value_in(units.m)
+        r_out = numpy.maximum(stars.acc_cutoff.value_in(units.m),
+                              stars.grav_acc_cutoff.value_in(units.m))
+        steps = numpy.linspace(0., 1., self.potential_table_size)
+        radii = r_in[:, None] * (r_out / r_in)[:, None]**steps
+
+        indices = numpy.repeat(numpy.arange(len(stars)), len(steps))
+        acc = self.conservative_acceleration(StarArrays(stars, indices),
+                                             radii.ravel() | units.m)
+        acc = acc.value_in(units.m/units.s**2).reshape(radii.shape)
+
+        pieces = 0.5 * (acc[:, 1:] + acc[:, :-1]) * numpy.diff(radii, axis=1)
+        potential = numpy.zeros_like(radii)
+        potential[:, :-1] = numpy.cumsum(pieces[:, ::-1], axis=1)[:, ::-1]
+
+        self.potential_tables = radii, potential
+        return self.potential_tables
+
+    def get_potential_at_point(self, radius, x, y, z):
+        self.check_cache_state()
+        positions = numpy.transpose([x.value_in(units.m),
+                                     y.value_in(units.m),
+                                     z.value_in(units.m)])
+        star_positions = self.particles.position.value_in(units.m)
+        radii, tables = self.potential_table()
+
+        potential = numpy.zeros(len(positions))
+        for star_position, r, table in zip(star_positions, radii, tables):
+            distance = numpy.sqrt(((positions - star_position)**2).sum(1))
+            potential += numpy.interp(distance, r, table,
+                                      left=table[0], right=0.)
+
+        return potential | units.m**2/units.s**2
+
+    def timestep_table(self, eta):
+        """
+            Tabulate the largest safe kick step of every star on a log grid
+            from the stellar radius to the outermost cutoff. At each radius
+            the step is eta * min(v/|a|, r/v): the wind velocity changes by
+            at most a fraction eta per kick and a particle moves at most a
+            fraction eta of its distance. Since the wind moves outward, the
+            step at r is the minimum over all radii beyond r.
+        """
+        if self.timestep_tables is not None and self.timestep_tables[0] == eta:
+            return self.timestep_tables[1:]
+
+        stars = self.particles
+        r_in = stars.radius.value_in(units.m)
+        r_out = numpy.maximum(stars.acc_cutoff.value_in(units.m),
+                              stars.grav_acc_cutoff.value_in(units.m))
+        steps = numpy.linspace(0., 1., self.timestep_table_size)
+        radii = r_in[:, None] * (r_out / r_in)[:, None]**steps
+
+        star_arrays = StarArrays(stars, numpy.repeat(numpy.arange(len(stars)),
+                                                     len(steps)))
+        acc = self.conservative_acceleration(star_arrays,
+                                             radii.ravel() | units.m)
+        v = self.profile("velocity_from_radius", radii.ravel() | units.m,
+                         star_arrays)
+        acc = abs(acc.value_in(units.m/units.s**2)).reshape(radii.shape)
+        v = abs(v.value_in(units.m/units.s)).reshape(radii.shape)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            dt = eta * numpy.minimum(v / acc, radii / v)
+        dt[~(dt > 0)] = numpy.inf
+        dt = numpy.minimum.accumulate(dt[:, ::-1], axis=1)[:, ::-1]
+
+        self.timestep_tables = eta, radii, dt
+        return radii, dt
+
+    def closest_gas_distances(self, gas):
+        """
+            The distance of the nearest gas particle to every star, in m.
+        """
+        star_positions = self.particles.position.value_in(units.m)
+        closest = numpy.full(len(star_positions), numpy.inf)
+        if gas is None or len(gas) == 0:
+            return closest
+
+        positions = gas.position.value_in(units.m)
+        block = max(1, self.gravity_chunk_size // len(positions))
+        for start in range(0, len(star_positions), block):
+            chunk = star_positions[start:start + block]
+            distances = ((positions[None, :, :] - chunk[:, None, :])**2).sum(2)
+            closest[start:start + block] = numpy.sqrt(distances.min(axis=1))
+        return closest
+
+    def recommended_timestep(self, gas=None, eta=0.1, per_star=False,
+                             particles_per_emission=1):
+        """
+            Returns (kick, emission): the largest safe bridge kick step and
+            the wind emission interval. The kick is looked up for every star
+            at its nearest gas particle in 'gas' (the target gas by default)
+            in a table that is cached until the stars change; a star without
+            gas nearby does not limit the step. With a staging_radius and gas
+            inside it the kick is at most bridge_time_step. The emission
+            interval is the time in which a star loses particles_per_emission
+            particle masses. With per_star the values of every star are
+            returned instead of the minimum.
+        """
+        with self.stats.phase("recommended_timestep"):
+            if gas is None:
+                gas = self.target_gas
+            self.check_cache_state()
+            radii, table = self.timestep_table(eta)
+
+            closest = self.closest_gas_distances(gas)
+            r_star = radii[:, 0]
+            r_out = radii[:, -1]
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                index = ((len(table[0]) - 1) * numpy.log(closest / r_star)
+                         / numpy.log(r_out / r_star))
+            index = numpy.clip(numpy.nan_to_num(index), 0, len(table[0]) - 1)
+            kick = table[numpy.arange(len(table)), index.astype(int)]
+            kick[closest > r_out] = numpy.inf
+
+            if self.staging_radius is not None:
+                staged = closest < self.staging_radius * r_star
+                kick[staged] = numpy.minimum(
+                    kick[staged], self.bridge_time_step.value_in(units.s))
+
+            emission = (particles_per_emission
+                        * self.particle_mass(self.particles)
+                        / self.particles.wind_mass_loss_rate).value_in(units.s)
+            emission = emission * numpy.ones(len(self.particles))
+
+        if per_star:
+            return kick | units.s, emission | units.s
+        if len(kick) == 0:
+            return numpy.inf | units.s, numpy.inf | units.s
+        return kick.min() | units.s, emission.min() | units.s
+
+    def calculate_gravity_at_point(self, eps, x, y, z, stars=None):
+        """
+            Evaluates all star - point pairs in vectorized blocks of at most
+            gravity_chunk_size pairs.
+        """
+        if stars is None:
+            stars = self.particles
+        positions = numpy.transpose([x.value_in(units.m),
+                                     y.value_in(units.m),
+                                     z.value_in(units.m)])
+        star_positions = stars.position.value_in(units.m)
+        total_acceleration = numpy.zeros(positions.shape)
+
+        n_points = max(len(positions), 1)
+        n_block = max(1, self.gravity_chunk_size // n_points)
+        for start in range(0, len(stars), n_block):
+            star_indices = numpy.arange(start, min(start + n_block, len(stars)))
+            relative_position = (positions[None, :, :]
+                                 - star_positions[star_indices, None, :])
+            distance = numpy.sqrt((relative_position**2).sum(2))
+
+            indices = numpy.repeat(star_indices, len(positions))
+            with self.stats.phase("acceleration"):
+                acceleration = self.conservative_acceleration(
+                    StarArrays(stars, indices), distance.ravel() | units.m)
+            acceleration = acceleration.value_in(units.m/units.s**2)
+            acceleration = acceleration.reshape(distance.shape)
+
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                direction = relative_position / distance[:, :, None]
             # Correct for directionless vectors with length 0
             direction[numpy.isnan(direction)] = 0
-            total_acceleration += direction * self.as_three_vector(acceleration)
+            total_acceleration += (direction
+                                   * acceleration[:, :, None]).sum(0)
+
+        total_acceleration = total_acceleration | units.m/units.s**2
+
+        if self.staging_radius is not None:
+            positions = positions | units.m
+            for star in stars:
+                relative_position = positions - star.position
+                distance = relative_position.lengths()
+                i_stag = distance < star.radius * self.staging_radius
+                if not i_stag.any():
+                    continue
+                acceleration = numpy.zeros(len(distance)) | units.m/units.s**2
+                acceleration[i_stag] = self.staging_accelerations(
+                    i_stag, distance[i_stag], star)
+                direction = relative_position / self.as_three_vector(distance)
+                direction[numpy.isnan(direction)] = 0
+                total_acceleration += (direction
+                                       * self.as_three_vector(acceleration))
 
         return total_acceleration.transpose()
 
@@ -911,42 +2445,504 @@ class MechanicalLuminosityWind(SimpleWind):
         return (self.feedback_efficiency * mechanical_energy_to_remove
                 / mass_lost)
 
-    def wind_sphere(self, star, Ngas):
-        wind = Particles(Ngas)
+    def wind_sphere(self, star, Ngas, random=None):
+        wind = WindQuantities(Ngas)
 
         r_max = self.r_max or self.r_max_ratio * star.radius
-        wind.position, direction = self.generate_positions(Ngas, star.radius, r_max)
+        wind.position, direction = self.generate_positions(
+            Ngas, star.radius, r_max, random=random)
         wind.velocity = [0, 0, 0] | units.kms
 
         return wind
 
+    def steady_state_velocity(self, stars, radii):
+        return numpy.zeros(radii.shape) | units.kms
+
+    def steady_state_internal_energy(self, stars, wind):
+        """
+            In a steady state, the mechanical energy per unit of lost mass
+            is half the terminal velocity squared.
+        """
+        return (self.feedback_efficiency * 0.5
+                * stars.terminal_wind_velocity**2)
+
+    def travel_times(self, stars, r_out, chunk_size, table_size):
+        raise AmuseException("the mechanical wind does not travel, give a"
+                             " number or time to steady_state_wind")
+
+    def steady_state_radii(self, stars, unique, rows, quantiles, tau, r_out,
+                           table_size):
+        """
+            The particles are spread evenly over the volume between the
+            stellar radius and r_max.
+        """
+        r_star = stars.radius[unique]
+        r_max = numpy.ones(len(unique)) * (self.r_max
+                                           or self.r_max_ratio * r_star)
+        r_star = r_star.value_in(units.m)[rows]
+        r_max = r_max.value_in(units.m)[rows]
+        return (r_star**3 + quantiles * (r_max**3 - r_star**3))**(1./3.)
+
     def reset(self):
         super(MechanicalLuminosityWind, self).reset()
         self.previous_time = 0 | units.Myr
 
 
+class GridSourceWind(SimpleWind):
+    """
+        This wind model creates no particles at all. Instead, the mass,
+        momentum and energy lost by the stars are added as source terms to
+        the regular grid of an Eulerian hydro code (the attributes rho,
+        rhovx, rhovy, rhovz and energy), spread over a sphere of
+        deposit_radius around every star, but at least deposit_cells cells.
+        The weight of a cell is its approximate overlap with the sphere, a
+        linear ramp over one cell width at the edge of the sphere.
+
+        With inject_momentum the wind leaves the sphere radially at the
+        terminal velocity, with the internal energy of the stellar surface
+        temperature. Otherwise it moves with the star and the integrated
+        mechanical luminosity, times the feedback_efficiency, is added as
+        thermal energy (as in MechanicalLuminosityWind).
+
+        The 'target gas' of this mode is the grid, e.g.:
+
+            new_stellar_wind(mass, hydro.grid, timestep, mode="grid")
+
+        The sph_particle_mass is not used, since there are no particles.
+        create_initial_wind and create_steady_state_wind deposit the steady
+        state wind profile on the grid instead.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.deposit_radius = kwargs.pop("deposit_radius", 0. | units.m)
+        self.deposit_cells = kwargs.pop("deposit_cells", 2.)
+        self.inject_momentum = kwargs.pop("inject_momentum", True)
+        self.feedback_efficiency = kwargs.pop("feedback_efficiency", 1.)
+        self.grid_chunk_size = kwargs.pop("grid_chunk_size", 10**6)
+        super(GridSourceWind, self).__init__(*args, **kwargs)
+
+        self.target_grid = None
+        self.particles.track_mechanical_energy(True)
+
+    def set_target_gas(self, target_grid, timestep):
+        self.set_target_grid(target_grid, timestep)
+
+    def set_target_grid(self, target_grid, timestep):
+        self.target_grid = target_grid
+        self.timestep = timestep
+
+    def has_target(self):
+        return self.target_grid is not None
+
+    def has_new_wind_particles(self):
+        return (self.particles.lost_mass > quantities.zero).any()
+
+    def create_wind_particles(self):
+        raise AmuseException("the grid wind mode creates no particles, use"
+                             " deposit_sources")
+
+    def steady_state_wind(self, *args, **kwargs):
+        raise AmuseException("the grid wind mode creates no particles, use"
+                             " create_steady_state_wind")
+
+    def create_initial_wind(self, number=None, time=None, check_length=True):
+        """
+            Deposits the wind on the target grid as if it has been blowing
+            for 'time' (see create_steady_state_wind). A 'number' of
+            particles can not be given, since none are created.
+        """
+        if number is not None:
+            raise AmuseException("the grid wind mode creates no particles,"
+                                 " give create_initial_wind a time")
+        deposited = self.create_steady_state_wind(time=time)
+        if check_length and len(deposited) == 0:
+            raise AmuseException("create_initial_wind time was too small to"
+                                 " deposit any wind.")
+        return deposited
+
+    def create_steady_state_wind(self, time=None, radius=None):
+        """
+            Adds the steady state wind of all stars to the target grid, as
+            if it has been blowing for 'time', or until it reached
+            'radius': a density rho(r) = m_dot / (4 pi r**2 v) moving at
+            the terminal velocity out to that distance. Every cell gets
+            rho times its volume, so the wind beyond the edge of the grid
+            is left out. Stars whose wind does not reach beyond the
+            deposit sphere have all of it spread over that sphere instead.
+            The stars are not evolved. Returns the indices of the stars
+            that are on the grid.
+        """
+        if not self.has_target():
+            raise AmuseException("create_steady_state_wind needs a target"
+                                 " grid")
+        self.particles.update_wind_velocities()
+        stars = self.particles
+        r_star = stars.radius.value_in(units.m) * numpy.ones(len(stars))
+        speed = stars.terminal_wind_velocity.value_in(units.m/units.s)
+        speed = speed * numpy.ones(len(stars))
+        if time is not None:
+            tau = time.value_in(units.s) * numpy.ones(len(stars))
+            r_out = r_star + speed * tau
+        elif radius is not None:
+            r_out = radius.value_in(units.m) * numpy.ones(len(stars))
+            tau = numpy.maximum(r_out - r_star, 0.) / speed
+        else:
+            raise AmuseException("create_steady_state_wind needs a time or"
+                                 " radius")
+
+        m_dot = stars.wind_mass_loss_rate.value_in(units.kg/units.s)
+        lost_mass = m_dot * tau
+        mechanical_energy = 0.5 * lost_mass * speed**2
+
+        # the cell of a star holds the wind within a sphere of its volume
+        cell_volume = self.grid_geometry(self.target_grid)[1].prod()
+        r_min = numpy.maximum(
+            r_star, (3. * cell_volume / (4. * numpy.pi))**(1./3.)
+            / numpy.sqrt(3.))
+
+        def density(star, distance):
+            """
+                The fraction of the lost mass of the stars per unit of
+                volume at 'distance'.
+            """
+            r = numpy.maximum(distance, r_min[star])
+            return 1. / (4. * numpy.pi * r**2 * (r_out - r_star)[star])
+
+        with self.stats.phase("deposit_sources"):
+            terms = self.source_terms(self.target_grid, lost_mass,
+                                      mechanical_energy, r_out, density)
+            self.add_source_terms(self.target_grid, *terms[:3])
+        return terms[3]
+
+    def release_wind(self):
+        if self.has_new_wind_particles():
+            self.deposit_sources(self.target_grid)
+
+    def grid_geometry(self, grid):
+        """
+            The lower corner, the cell size and the shape of a regular grid,
+            in m.
+        """
+        cellsize = grid.cellsize().value_in(units.m)
+        corner = grid.get_minimum_position().value_in(units.m)
+        return corner, cellsize, numpy.array(grid.shape[:3])
+
+    def deposit_weights(self, grid, indices, radius=None, density=None):
+        """
+            Yields blocks of (stars, cells, weights, offsets) for the
+            stars[indices]: the index in 'indices' and the flat grid index
+            of every star-cell pair with a non-zero weight, the weight, and
+            the offset of the cell centre from the star in m. The stars are
+            spread over the deposit sphere, or over 'radius' (in m, per
+            star) if that is larger, with weights normalised to one per
+            star. With a 'density' function of the star (index in
+            'indices') and the distance of the cells, the stars with a
+            radius beyond the deposit sphere get the density times the
+            cell volume as weights instead, without normalisation.
+        """
+        corner, cellsize, shape = self.grid_geometry(grid)
+        positions = self.particles[indices].position.value_in(units.m)
+        minimum = numpy.maximum(self.deposit_radius.value_in(units.m),
+                                self.deposit_cells * cellsize.max())
+        if radius is None:
+            radius = minimum * numpy.ones(len(indices))
+        normalise = numpy.ones(len(indices), dtype=bool)
+        if density is not None:
+            normalise = radius <= minimum
+        radius = numpy.maximum(radius, minimum)
+        ramp = cellsize.min()
+
+        # the box of cells of every star that the sphere reaches, on the grid
+        extent = (radius + 0.5 * ramp)[:, None]
+        low = numpy.clip(numpy.floor((positions - extent - corner)
+                                     / cellsize), 0, shape).astype(int)
+        high = numpy.clip(numpy.floor((positions + extent - corner)
+                                      / cellsize) + 1, 0, shape).astype(int)
+
+        def weigh(star, cells):
+            offsets = corner + (cells + 0.5) * cellsize - positions[star]
+            distance = numpy.sqrt((offsets**2).sum(axis=1))
+            weights = numpy.clip((radius[star] - distance) / ramp + 0.5,
+                                 0., 1.)
+            if density is not None:
+                weights = numpy.where(
+                    normalise[star], weights, weights * cellsize.prod()
+                    * density(star, distance))
+            return weights, offsets
+
+        totals = None
+        everyone = numpy.arange(len(indices))
+        if (high - low).prod(axis=1).sum() > self.grid_chunk_size:
+            # the boxes are split over blocks, so total the weights first
+            totals = numpy.zeros(len(indices))
+            for star, cells in self.box_cells(low, high, everyone[normalise]):
+                totals += numpy.bincount(star, weigh(star, cells)[0],
+                                         len(indices))
+
+        for star, cells in self.box_cells(low, high, everyone):
+            weights, offsets = weigh(star, cells)
+            total = totals
+            if total is None:
+                total = numpy.bincount(star, weights, len(indices))
+            total = numpy.where(normalise & (total > 0), total, 1.)
+            weights /= total[star]
+            pair = numpy.nonzero(weights)[0]
+            flat = numpy.ravel_multi_index(cells[pair].T, shape)
+            yield star[pair], flat, weights[pair], offsets[pair]
+
+    def box_cells(self, low, high, stars):
+        """
+            Yields blocks of (star, cells) of at most grid_chunk_size cells:
+            the 3d index of every cell from low to high (exclusive) of the
+            'stars', and the star it belongs to. The cells of a star can be
+            split over blocks.
+        """
+        sizes = (high - low)[stars]
+        counts = sizes.prod(axis=1)
+        ends = numpy.cumsum(counts)
+        total = ends[-1] if len(ends) else 0
+        for start in range(0, total, self.grid_chunk_size):
+            index = numpy.arange(start, min(start + self.grid_chunk_size,
+                                            total))
+            rows = numpy.searchsorted(ends, index, side="right")
+            index = index - (ends - counts)[rows]
+            size = sizes[rows]
+            cells = numpy.empty((len(index), 3), dtype=int)
+            cells[:, 2] = index % size[:, 2]
+            index //= size[:, 2]
+            cells[:, 1] = index % size[:, 1]
+            cells[:, 0] = index // size[:, 1]
+            yield stars[rows], cells + low[stars[rows]]
+
+    def source_terms(self, grid, lost_mass=None, mechanical_energy=None,
+                     radius=None, density=None):
+        """
+            The mass, momentum and energy (in SI units) that the wind adds
+            to every cell of 'grid', as flat arrays, and the indices of the
+            stars that could deposit their wind. By default this is the
+            lost_mass and mechanical_energy of the stars, otherwise the
+            given arrays (in SI units), spread as in deposit_weights. The
+            'density' function is called with the indices of the stars in
+            self.particles.
+        """
+        if lost_mass is None:
+            lost_mass = self.particles.lost_mass.value_in(units.kg)
+            mechanical_energy = self.particles.mechanical_energy.value_in(
+                units.J)
+        indices = numpy.nonzero(lost_mass > 0)[0]
+        stars = self.particles[indices]
+        size = numpy.prod(grid.shape[:3])
+        mass = numpy.zeros(size)
+        momentum = numpy.zeros((3, size))
+        energy = numpy.zeros(size)
+        deposited = numpy.zeros(len(indices), dtype=bool)
+        if len(indices) == 0:
+            return mass, momentum, energy, indices
+
+        lost_mass = lost_mass[indices]
+        star_velocity = stars.velocity.value_in(units.m/units.s)
+        wind_speed = stars.terminal_wind_velocity.value_in(units.m/units.s)
+        wind_speed = wind_speed * numpy.ones(len(stars))
+        if self.inject_momentum:
+            specific_energy = self.internal_energy_from_temperature(stars)
+            thermal = lost_mass * specific_energy.value_in(units.J/units.kg)
+        else:
+            thermal = self.feedback_efficiency * mechanical_energy[indices]
+
+        star_density = None
+        if density is not None:
+            def star_density(star, distance):
+                return density(indices[star], distance)
+
+        with self.stats.phase("deposit_weights"):
+            for star, cell, weight, offset in self.deposit_weights(
+                    grid, indices, None if radius is None else radius[indices],
+                    star_density):
+                deposited[star] = True
+                velocity = star_velocity[star]
+                if self.inject_momentum:
+                    distance = numpy.sqrt((offset**2).sum(axis=1))[:, None]
+                    direction = offset / numpy.where(distance > 0,
+                                                     distance, 1.)
+                    velocity = velocity + wind_speed[star, None] * direction
+                dm = weight * lost_mass[star]
+                mass += numpy.bincount(cell, dm, size)
+                for i in range(3):
+                    momentum[i] += numpy.bincount(cell, dm * velocity[:, i],
+                                                  size)
+                energy += numpy.bincount(
+                    cell, 0.5 * dm * (velocity**2).sum(axis=1)
+                    + weight * thermal[star], size)
+
+        return mass, momentum, energy, indices[deposited]
+
+    def deposit_sources(self, grid):
+        """
+            Add the wind of all stars to 'grid'. The lost mass and the
+            mechanical energy of the stars are reset, except for stars
+            outside the grid, which keep their wind until they are inside.
+        """
+        with self.stats.phase("deposit_sources"):
+            mass, momentum, energy, deposited = self.source_terms(grid)
+            self.add_source_terms(grid, mass, momentum, energy)
+
+            stars = self.particles[deposited]
+            self.stats.count("deposited_stars", len(deposited))
+            stars.lost_mass = 0. | units.kg
+            stars.mechanical_energy = 0. | units.J
+            stars.wind_release_time = self.model_time
+        return deposited
+
+    def add_source_terms(self, grid, mass, momentum, energy):
+        shape = grid.shape[:3]
+        volume = numpy.prod(grid.cellsize().value_in(units.m))
+        density = units.kg/units.m**3
+        grid.rho += (mass.reshape(shape) / volume) | density
+        for i, name in enumerate(["rhovx", "rhovy", "rhovz"]):
+            setattr(grid, name, getattr(grid, name)
+                    + (momentum[i].reshape(shape) / volume
+                       | density * units.m/units.s))
+        grid.energy += (energy.reshape(shape) / volume) | units.J/units.m**3
+
+
+class DistributedWind(object):
+    """
+        Mixin that spreads the work of a wind code over the MPI ranks of
+        'comm' (an mpi4py communicator). Every rank holds all stars and
+        evolves their mass loss, but creates wind particles and gravity
+        only for its own share of the stars, balanced by mass loss rate.
+        The results are combined on all ranks, so each rank has the same
+        interface as the serial code. All ranks have to make the same
+        calls with the same arguments, and hold the same stars with the
+        same keys (e.g. broadcast the star set from rank 0).
+
+        The wind of each star is drawn from its own random generator (see
+        SimpleWind.random_state_for), so for a fixed random_seed the
+        particles are identical to those of the serial code. Gravity is
+        summed over the ranks, which can differ from the serial sum in the
+        last bits. Try it with e.g.
+
+            mpirun -n 4 python script.py
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.comm = kwargs.pop("comm")
+        if kwargs.get("random_seed") is None:
+            seed = numpy.random.randint(2**31) if self.comm.rank == 0 else None
+            kwargs["random_seed"] = self.comm.bcast(seed, root=0)
+        super(DistributedWind, self).__init__(*args, **kwargs)
+
+    def local_star_indices(self):
+        """
+            The indices of the stars of this rank. The stars are sorted by
+            mass loss rate and dealt out back and forth over the ranks.
+        """
+        rate = self.particles.wind_mass_loss_rate.value_in(
+            units.MSun/units.yr)
+        order = numpy.argsort(-rate, kind="mergesort")
+        size = self.comm.size
+        turn = numpy.arange(len(order)) % (2 * size)
+        ranks = numpy.where(turn < size, turn, 2 * size - 1 - turn)
+        return numpy.sort(order[ranks == self.comm.rank])
+
+    def synchronised_attributes(self):
+        names = ["lost_mass", "wind_release_time"]
+        if self.particles.collection_attributes.track_mechanical_energy:
+            names.append("mechanical_energy")
+        return names
+
+    def create_wind_particles(self):
+        with self.stats.phase("create_wind_particles"):
+            local = self.local_star_indices()
+            names = self.synchronised_attributes()
+            new_particles = []
+            values = None
+            if len(local) > 0:
+                stars = self.particles[local]
+                new_particles = [(local[i], wind) for i, wind
+                                 in self.wind_per_star(stars)]
+                values = [getattr(stars, name) for name in names]
+
+            with self.stats.phase("mpi_gather"):
+                all_particles = self.comm.allgather(new_particles)
+                all_values = self.comm.allgather((local, values))
+
+            for indices, values in all_values:
+                if len(indices) > 0:
+                    stars = self.particles[indices]
+                    for name, value in zip(names, values):
+                        setattr(stars, name, value)
+
+            return self.wind_output(
+                [wind for i, wind in sorted(sum(all_particles, []),
+                                            key=lambda item: item[0])])
+
+    def calculate_gravity_at_point(self, eps, x, y, z, stars=None):
+        from mpi4py import MPI
+
+        local = self.local_star_indices()
+        if len(local) > 0:
+            partial = super(DistributedWind, self).calculate_gravity_at_point(
+                eps, x, y, z, stars=self.particles[local])
+            partial = partial.value_in(units.m/units.s**2)
+        else:
+            partial = numpy.zeros((3, len(x)))
+
+        partial = numpy.ascontiguousarray(partial, dtype=numpy.float64)
+        total = numpy.empty_like(partial)
+        with self.stats.phase("mpi_reduce"):
+            self.comm.Allreduce(partial, total, op=MPI.SUM)
+        return total | units.m/units.s**2
+
+
+def distributed(wind_class):
+    """
+        The DistributedWind version of a wind code class.
+    """
+    return type("Distributed" + wind_class.__name__,
+                (DistributedWind, wind_class), {})
+
+
+wind_modes = {"simple": SimpleWind,
+              "accelerate": AcceleratingWind,
+              "mechanical": MechanicalLuminosityWind,
+              "grid": GridSourceWind,
+              }
+
+
 def new_stellar_wind(sph_particle_mass, target_gas=None, timestep=None,
-                     derive_from_evolution=False, mode="simple", **kwargs):
+                     derive_from_evolution=False, mode="simple", comm=None,
+                     **kwargs):
     """
         Create a new stellar wind code.
         target_gas: a gas particle set into which the wind particles should be
-            put (requires timestep)
+            put (requires timestep), or the grid for the 'grid' mode
         timestep: the timestep at which the wind particles should be generated.
         derive_from_evolution: derive the wind parameters from stellar
             evolution (you still need to update the stellar parameters)
-        mode: set to 'simple', 'accelerate' or 'mechanical'
+        mode: set to 'simple', 'accelerate', 'mechanical' or 'grid' (see
+            GridSourceWind, which ignores sph_particle_mass)
+        comm: an mpi4py communicator, to divide the stars over its ranks
+            (see DistributedWind)
+        wind_velocity_prescription: the name of a registered terminal wind
+            velocity prescription (see register_wind_velocity_prescription),
+            'kudritzki' by default with derive_from_evolution
+        output_format: 'particles' (default), or 'structured' / 'arrays'
+            for a WindBatch of plain arrays (see SimpleWind.wind_output),
+            with output_units and output_precision (e.g. numpy.float32);
+            give an output_origin near the stars with a low precision
     """
     if (target_gas is None) ^ (timestep is None):
         raise AmuseException("Must specify both target_gas and timestep"
                              "(or neither)")
 
-    wind_modes = {"simple": SimpleWind,
-                  "accelerate": AcceleratingWind,
-                  "mechanical": MechanicalLuminosityWind,
-                  }
+    wind_class = wind_modes[mode]
+    if comm is not None:
+        wind_class = distributed(wind_class)
+        kwargs["comm"] = comm
 
-    stellar_wind = wind_modes[mode](sph_particle_mass, derive_from_evolution,
-                                    **kwargs)
+    stellar_wind = wind_class(sph_particle_mass, derive_from_evolution,
+                              **kwargs)
 
     if target_gas is not None:
         stellar_wind.set_target_gas(target_gas, timestep)
@@ -973,3 +2969,136 @@ def static_wind_from_stellar_evolution(stellar_wind, stellar_evolution,
     stellar_wind.reset()
 
     return stellar_wind
+
+
+def wind_profile_sweep(stars, radii, parameters,
+                       acceleration_function="logistic",
+                       acceleration_function_args=None, v_init_ratio=None,
+                       r_out_ratio=5, acc_start_ratio=2, chunk_size=10**6,
+                       table_size=256):
+    """
+        Evaluate the AcceleratingWind profiles for every combination of the
+        values in 'parameters', every star and every radius, in vectorized
+        blocks of at most chunk_size points, without creating wind codes.
+        parameters: a dict (or a list of (name, values) pairs) of arrays of
+            arguments of the acceleration function (e.g. steepness, r_mid
+            or alpha) and of the wind parameters v_init_ratio, r_out_ratio
+            and acc_start_ratio; the others take the fixed values given.
+        radii: in units of the stellar radius, unless it is a quantity.
+            The velocity law only holds outside the star, so radii should
+            not be smaller than the stellar radius.
+        Returns a dict with the 'dims' and 'coords' of the results and the
+        velocity, acceleration, density and travel_time (from the stellar
+        surface) of shape (one axis per parameter) + (stars, radii). The
+        travel times are integrated on table_size radii between the
+        surface and the largest radius, and interpolated to 'radii'.
+    """
+    if isinstance(parameters, dict):
+        parameters = sorted(parameters.items())
+    names = [name for name, values in parameters]
+    values = [numpy.atleast_1d(values) for name, values in parameters]
+
+    if isinstance(acceleration_function, str):
+        acceleration_function = AcceleratingWind.acc_functions[
+            acceleration_function]
+    for method in ["acceleration_from_radius", "velocity_from_radius"]:
+        if method not in acceleration_function.vectorized_methods:
+            raise AmuseException(acceleration_function.__name__ + " can not"
+                                 " be evaluated for a parameter sweep")
+
+    shape = tuple(len(v) for v in values)
+    combinations = [grid.ravel()
+                    for grid in numpy.meshgrid(*values, indexing="ij")]
+    n_sets = int(numpy.prod(shape))
+    n_stars = len(stars)
+    n_radii = len(radii)
+
+    # in the unit of the stellar radii, so that the surface is exact
+    length = stars.radius.unit
+    in_m = (1. | length).value_in(units.m)
+    r_star = stars.radius.value_in(length) * numpy.ones(n_stars)
+    if quantities.is_quantity(radii):
+        r = numpy.ones((n_stars, 1)) * radii.value_in(length)
+    else:
+        r = r_star[:, None] * numpy.asarray(radii, dtype=float)
+    r_max = numpy.maximum(r.max(axis=1), r_star)
+    width = numpy.where(r_max > r_star, r_max - r_star, 1.)
+    x = numpy.clip((r - r_star[:, None]) / width[:, None], 0., 1.)
+
+    m_dot = stars.wind_mass_loss_rate.value_in(units.kg/units.s)
+    m_dot = m_dot * numpy.ones(n_stars)
+
+    def profiles(sets, radii):
+        """
+            The velocity and acceleration at 'radii', one row per star, for
+            the parameter sets 'sets'.
+        """
+        n_points = radii.shape[1]
+        set_index = numpy.repeat(sets, n_stars * n_points)
+        star_index = numpy.tile(numpy.repeat(numpy.arange(n_stars),
+                                             n_points), len(sets))
+
+        settings = {"v_init_ratio": v_init_ratio, "r_out_ratio": r_out_ratio,
+                    "acc_start_ratio": acc_start_ratio}
+        function_args = dict(acceleration_function_args or {})
+        for name, combination in zip(names, combinations):
+            if name in settings:
+                settings[name] = combination[set_index]
+            else:
+                function_args[name] = combination[set_index]
+
+        star = StarArrays(stars, star_index)
+        if settings["v_init_ratio"] is not None:
+            star.initial_wind_velocity = (settings["v_init_ratio"]
+                                          * star.terminal_wind_velocity)
+        elif not hasattr(stars, "initial_wind_velocity"):
+            star.initial_wind_velocity = star.terminal_wind_velocity
+        star.acc_cutoff = settings["r_out_ratio"] * star.radius
+        star.acc_start = settings["acc_start_ratio"] * star.radius
+
+        function = acceleration_function(**function_args)
+        points = numpy.tile(radii.ravel(), len(sets)) | length
+        block_shape = (len(sets), n_stars, n_points)
+        ones = numpy.ones(block_shape)
+        v = function.velocity_from_radius(points, star)
+        a = function.acceleration_from_radius(points, star)
+        return (v.value_in(units.m/units.s).reshape(block_shape) * ones,
+                a.value_in(units.m/units.s**2).reshape(block_shape) * ones)
+
+    velocity = numpy.zeros((n_sets, n_stars, n_radii))
+    acceleration = numpy.zeros_like(velocity)
+    density = numpy.zeros_like(velocity)
+    travel_time = numpy.zeros_like(velocity)
+
+    per_set = n_stars * (n_radii + table_size)
+    block = max(1, chunk_size // max(1, per_set))
+    for start in range(0, n_sets, block):
+        sets = numpy.arange(start, min(start + block, n_sets))
+        v, a = profiles(sets, r)
+        velocity[sets] = v
+        acceleration[sets] = a
+        density[sets] = m_dot[:, None] / (4. * numpy.pi * (r * in_m)**2 * v)
+
+        r_table, times = travel_time_table(
+            r_star, r_max, table_size,
+            lambda radii: profiles(sets, radii)[0])
+        times = in_m * times.reshape(-1, table_size)
+        x_table = (r_table - r_star[:, None]) / width[:, None]
+        rows = numpy.repeat(numpy.arange(len(times)), n_radii)
+        travel_time[sets] = interpolate_rows(
+            numpy.tile(x.ravel(), len(sets)), rows,
+            numpy.tile(x_table, (len(sets), 1)),
+            times).reshape(len(sets), n_stars, n_radii)
+
+    result_shape = shape + (n_stars, n_radii)
+    coords = OrderedDict(zip(names, values))
+    coords["star"] = stars.key
+    coords["radius"] = radii
+    return {"dims": tuple(names) + ("star", "radius"),
+            "coords": coords,
+            "velocity": velocity.reshape(result_shape) | units.m/units.s,
+            "acceleration": (acceleration.reshape(result_shape)
+                             | units.m/units.s**2),
+            "density": density.reshape(result_shape) | units.kg/units.m**3,
+            "travel_time": travel_time.reshape(result_shape) | units.s,
+            }
@@ -0,0 +1,439 @@
+"""
+    Benchmarks for the hot paths of stellar_wind: wind creation and the
+    steady-state initial wind for every mode of new_stellar_wind,
+    generate_positions for every grid_type, a check that the numpy and
+    numba kernel backends agree, a check of the steady state travel times
+    against quad, the radius_from_number /
+    radius_from_time profiles of every acceleration function, a
+    wind_profile_sweep, get_gravity_at_point for a range of N_stars x N_gas
+    and the time it takes a fresh interpreter to import stellar_wind.
+
+    Everything runs offline on synthetic star clusters with a fixed seed.
+    Every run is appended to a history file, and with --baseline the
+    results are compared against a stored baseline: a benchmark is flagged
+    when its throughput drops, or its peak memory grows, by more than
+    --tolerance.
+
+    python stellar_wind_benchmark.py --save-baseline
+    python stellar_wind_benchmark.py --baseline
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy
+
+from amuse.datamodel import Particles
+from amuse.units import units
+
+import stellar_wind
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+
+# Benchmarks of code that does not work yet, and why. They are skipped
+# instead of failing in every report.
+KNOWN_BROKEN = {
+    "generate_positions/regular": "PositionGenerator.regular_grid_unit_cube"
+                                  " uses the undefined targetN and long",
+    "generate_positions/body_centered": "PositionGenerator."
+                                        "body_centered_grid_unit_cube uses"
+                                        " the undefined targetN and long",
+    "radius_from_number/nowotny": "NowotnyAcceleration is not implemented",
+    "radius_from_time/nowotny": "NowotnyAcceleration is not implemented",
+}
+
+
+def synthetic_cluster(n_stars, seed=42):
+    """
+        A cluster of massive stars with wind parameters, spread
+        over a 1 pc cube.
+    """
+    random = numpy.random.RandomState(seed)
+    stars = Particles(n_stars)
+    stars.mass = random.uniform(8., 60., n_stars) | units.MSun
+    stars.radius = random.uniform(5., 20., n_stars) | units.RSun
+    stars.temperature = random.uniform(2e4, 4.5e4, n_stars) | units.K
+    stars.luminosity = random.uniform(1e4, 1e6, n_stars) | units.LSun
+    stars.age = 1. | units.Myr
+    stars.position = random.uniform(-0.5, 0.5, (n_stars, 3)) | units.parsec
+    stars.velocity = random.normal(0., 2., (n_stars, 3)) | units.kms
+    stars.terminal_wind_velocity = (random.uniform(1e3, 3e3, n_stars)
+                                    | units.kms)
+    stars.wind_mass_loss_rate = (10**random.uniform(-7, -5, n_stars)
+                                 | units.MSun/units.yr)
+    return stars
+
+
+def new_wind(n_stars, mode="simple", particle_mass=1e-8 | units.MSun,
+             **kwargs):
+    wind = stellar_wind.new_stellar_wind(particle_mass, mode=mode, **kwargs)
+    wind.particles.add_particles(synthetic_cluster(n_stars))
+    return wind
+
+
+def wind_creation_benchmark(mode, n_stars, n_particles, **kwargs):
+    def setup():
+        numpy.random.seed(0)
+        wind = new_wind(n_stars, mode=mode, **kwargs)
+        mass_loss = wind.particles.wind_mass_loss_rate.sum()
+        wind.evolve_model(n_particles * wind.sph_particle_mass / mass_loss)
+        return wind.create_wind_particles
+    return setup, n_particles
+
+
+def steady_state_benchmark(mode, n_stars, n_particles, **kwargs):
+    def setup():
+        numpy.random.seed(0)
+        wind = new_wind(n_stars, mode=mode, **kwargs)
+        return lambda: sum(len(chunk) for chunk in
+                           wind.steady_state_wind(number=n_particles))
+    return setup, n_particles
+
+
+def positions_benchmark(grid_type, n_particles):
+    def setup():
+        numpy.random.seed(0)
+        generator = stellar_wind.PositionGenerator(grid_type=grid_type)
+        return lambda: generator.generate_positions(
+            n_particles, 1. | units.RSun, 10. | units.RSun)
+    return setup, n_particles
+
+
+def profile_benchmark(name, method, n_points):
+    def setup():
+        wind = new_wind(1, mode="accelerate", acceleration_function=name,
+                        v_init_ratio=0.1)
+        star = wind.particles[0]
+        function = wind.acc_function
+        if method == "radius_from_number":
+            numbers = numpy.linspace(0., 1., n_points)
+            r_max = 4. * star.radius
+            return lambda: function.radius_from_number(numbers, r_max, star)
+        times = numpy.linspace(0., 1., n_points) | units.day
+        return lambda: function.radius_from_time(times, star)
+    return setup, n_points
+
+
+def sweep_benchmark(n_values, n_stars, n_radii):
+    def setup():
+        stars = synthetic_cluster(n_stars)
+        radii = numpy.linspace(1.01, 8., n_radii)
+        parameters = {"steepness": numpy.linspace(2., 20., n_values),
+                      "r_mid": numpy.linspace(1.5, 4., n_values),
+                      "v_init_ratio": numpy.linspace(0.05, 0.5, n_values)}
+        return lambda: stellar_wind.wind_profile_sweep(stars, radii,
+                                                       parameters)
+    return setup, n_values**3 * n_stars * n_radii
+
+
+def gravity_benchmark(n_stars, n_gas):
+    def setup():
+        random = numpy.random.RandomState(1)
+        wind = new_wind(n_stars, mode="accelerate",
+                        acceleration_function="rsquared", v_init_ratio=0.1,
+                        gravity_cache_size=0)
+        stars = wind.particles
+        near = random.randint(0, n_stars, n_gas)
+        offsets = (random.normal(0., 3., (n_gas, 3))
+                   * stars.radius[near].value_in(units.RSun)[:, None])
+        x, y, z = (stars.position[near]
+                   + (offsets | units.RSun)).transpose()
+        return lambda: wind.get_gravity_at_point(0. | units.m, x, y, z)
+    return setup, n_stars * n_gas
+
+
+def backend_agreement_benchmark(n_points, rtol=1e-12):
+    """
+        Run every kernel with the numpy and the numba backend on the same
+        random input, and fail when the results differ by more than a
+        fraction 'rtol'.
+    """
+    random = numpy.random.RandomState(3)
+    r_star = random.uniform(1e9, 1e10, n_points)
+    r = r_star * random.uniform(1., 10., n_points)
+    v = random.uniform(1e5, 3e6, n_points)
+    m_dot = random.uniform(1e15, 1e18, n_points)
+    temperature = random.uniform(1e4, 5e4, n_points)
+    mu = random.uniform(1e-27, 2e-27, n_points)
+    g = random.uniform(1e2, 1e4, n_points)
+    h = stellar_wind.KB_SI * temperature / (g * mu)
+    r_inside = r_star - h * random.uniform(0., 5., n_points)
+    vectors = random.normal(0., 1e12, (n_points, 3))
+    calls = [
+        ("logistic_profile", (r, 0.1 * v, v, 3. * r_star, 10., 5. * r_star)),
+        ("pressure_acceleration", (r, v, v**2 / r, 1e11, m_dot, 0.1 * v,
+                                   r_star, 5./3.)),
+        ("atmospheric_acceleration", (r_inside, v, m_dot, v, r_star, g,
+                                      temperature, mu)),
+        ("unit_vectors", (vectors,)),
+        ("scale_vectors", (vectors, r)),
+    ]
+
+    backends = []
+
+    def setup():
+        if not backends:
+            backends.extend([stellar_wind.NumpyKernels(),
+                             stellar_wind.NumbaKernels()])
+
+        def compare():
+            for name, args in calls:
+                expected, found = [getattr(backend, name)(*args)
+                                   for backend in backends]
+                if isinstance(expected, numpy.ndarray):
+                    expected, found = [expected], [found]
+                for a, b in zip(expected, found):
+                    difference = abs(b - a).max() / abs(a).max()
+                    if not difference <= rtol:
+                        raise AssertionError(
+                            "{0}: numba differs from numpy by {1:.3g}"
+                            .format(name, difference))
+        return compare
+    return setup, n_points
+
+
+def travel_time_benchmark(n_stars, rtol=1e-4):
+    """
+        Compare the travel times that the steady state wind interpolates
+        in its tables with quad, out to 3 and to 10**4 stellar radii, and
+        fail when they differ by more than a fraction 'rtol'.
+    """
+    quad = stellar_wind.scipy_function("integrate", "quad")
+    winds = [("simple", {"compensate_gravity": True}),
+             ("accelerate", {"acceleration_function": "logistic",
+                             "v_init_ratio": 0.1}),
+             ("accelerate", {"acceleration_function": "rsquared",
+                             "v_init_ratio": 0.1})]
+
+    def setup():
+        def compare():
+            for mode, kwargs in winds:
+                wind = new_wind(n_stars, mode=mode, **kwargs)
+                stars = wind.particles
+                stars.update_wind_velocities()
+                r_star = stars.radius.value_in(units.m)
+                for ratio in [3., 1e4]:
+                    found = wind.travel_times(stars, ratio * r_star,
+                                              10**5, 256)
+                    for i in range(n_stars):
+                        star = stellar_wind.StarArrays(stars, numpy.array([i]))
+
+                        def dt_dlnr(ln_r):
+                            r = numpy.exp([ln_r]) | units.m
+                            v = wind.steady_state_velocity(star, r)
+                            return r[0].value_in(units.m) / v[0].value_in(
+                                units.m/units.s)
+                        expected = quad(dt_dlnr, numpy.log(r_star[i]),
+                                        numpy.log(ratio * r_star[i]),
+                                        epsabs=0., limit=200)[0]
+                        difference = abs(found[i] / expected - 1.)
+                        if not difference <= rtol:
+                            raise AssertionError(
+                                "{0} {1}: travel time to {2:g} stellar radii"
+                                " differs from quad by {3:.3g}".format(
+                                    mode, kwargs.get("acceleration_function",
+                                                     ""), ratio, difference))
+        return compare
+    return setup, n_stars
+
+
+IMPORT_SCRIPT = """
+import sys
+import stellar_wind
+loaded = [name for name in {0!r} if name in sys.modules]
+if loaded:
+    raise SystemExit("import stellar_wind loaded " + ", ".join(loaded))
+"""
+
+
+def import_benchmark(lazy_modules=("scipy", "numba", "mpi4py",
+                                   "amuse.ext.evrard_test")):
+    """
+        Start a fresh interpreter that imports stellar_wind, and fail
+        when that pulls in any of the modules that should be lazy.
+    """
+    script = IMPORT_SCRIPT.format(list(lazy_modules))
+    directory = os.path.dirname(os.path.abspath(stellar_wind.__file__))
+
+    def setup():
+        return lambda: subprocess.check_call([sys.executable, "-c", script],
+                                             cwd=directory)
+    return setup, 1
+
+
+def benchmarks(quick=False):
+    scale = 0.1 if quick else 1.
+    n_particles = int(1e5 * scale)
+    n_points = max(2, int(20 * scale))
+
+    result = [("import/stellar_wind", import_benchmark()),
+              ("kernels/numba_vs_numpy",
+               backend_agreement_benchmark(n_particles)),
+              ("steady_state/travel_time_vs_quad", travel_time_benchmark(5))]
+    for mode in ["simple", "accelerate", "mechanical"]:
+        kwargs = {"v_init_ratio": 0.1} if mode == "accelerate" else {}
+        result.append(("create_wind_particles/" + mode,
+                       wind_creation_benchmark(mode, 100, n_particles,
+                                               **kwargs)))
+        result.append(("create_steady_state_wind/" + mode,
+                       steady_state_benchmark(mode, 100, n_particles,
+                                              **kwargs)))
+    for output_format in ["structured", "arrays"]:
+        result.append(("create_wind_particles/simple/" + output_format,
+                       wind_creation_benchmark(
+                           "simple", 100, n_particles,
+                           output_format=output_format,
+                           output_precision=numpy.float32)))
+
+    for grid_type in ["random", "regular", "body_centered"]:
+        result.append(("generate_positions/" + grid_type,
+                       positions_benchmark(grid_type, n_particles)))
+
+    for name in sorted(stellar_wind.AcceleratingWind.acc_functions):
+        for method in ["radius_from_number", "radius_from_time"]:
+            result.append(("{0}/{1}".format(method, name),
+                           profile_benchmark(name, method, n_points)))
+
+    result.append(("wind_profile_sweep/logistic",
+                   sweep_benchmark(10, max(1, int(100 * scale)), 100)))
+
+    for n_stars in [1, 10, 100]:
+        for n_gas in [int(1e3 * scale), int(1e4 * scale), int(1e5 * scale)]:
+            result.append(("get_gravity_at_point/{0}x{1}".format(n_stars,
+                                                                  n_gas),
+                           gravity_benchmark(n_stars, n_gas)))
+    return result
+
+
+def measure(setup, n_items, repeat=3):
+    """
+        Best wall time of 'repeat' runs, the throughput in items per
+        second and the peak memory of the last run.
+    """
+    best = None
+    peak = None
+    for i in range(repeat):
+        function = setup()
+        if tracemalloc is not None and i == repeat - 1:
+            tracemalloc.start()
+        start = timer()
+        function()
+        elapsed = timer() - start
+        if tracemalloc is not None and i == repeat - 1:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        best = elapsed if best is None else min(best, elapsed)
+    return {"time": best,
+            "throughput": n_items / best if best > 0 else float("inf"),
+            "peak_memory": peak}
+
+
+def run(selection=None, quick=False, repeat=3):
+    results = {}
+    for name, (setup, n_items) in benchmarks(quick):
+        if selection and not any(s in name for s in selection):
+            continue
+        if name in KNOWN_BROKEN:
+            print("{0:48s} skipped: {1}".format(name, KNOWN_BROKEN[name]))
+            continue
+        try:
+            results[name] = measure(setup, n_items, repeat)
+        except Exception as exception:
+            results[name] = {"error": repr(exception)}
+        print(format_result(name, results[name]))
+    return results
+
+
+def format_result(name, result):
+    if "error" in result:
+        return "{0:48s} failed: {1}".format(name, result["error"])
+    memory = result["peak_memory"]
+    memory = "-" if memory is None else "{0:.1f} MB".format(memory / 2.**20)
+    return "{0:48s} {1:10.4f} s {2:12.4g} /s {3:>10s}".format(
+        name, result["time"], result["throughput"], memory)
+
+
+def regressions(results, baseline, tolerance):
+    """
+        The benchmarks that are slower, or use more memory, than the
+        baseline by more than a fraction 'tolerance', or that fail while
+        they ran in the baseline.
+    """
+    flagged = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None or "error" in reference:
+            continue
+        if "error" in result:
+            flagged.append((name, "error", None, result["error"]))
+            continue
+        if result["throughput"] < (1. - tolerance) * reference["throughput"]:
+            flagged.append((name, "throughput", reference["throughput"],
+                            result["throughput"]))
+        if (result["peak_memory"] is not None
+                and reference.get("peak_memory") is not None
+                and result["peak_memory"]
+                > (1. + tolerance) * reference["peak_memory"]):
+            flagged.append((name, "peak_memory", reference["peak_memory"],
+                            result["peak_memory"]))
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("select", nargs="*",
+                        help="only run benchmarks containing these strings")
+    parser.add_argument("--quick", action="store_true",
+                        help="run with 10 times smaller problem sizes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--history", default="stellar_wind_benchmark.jsonl",
+                        help="file to which every run is appended")
+    parser.add_argument("--baseline-file",
+                        default="stellar_wind_benchmark_baseline.json")
+    parser.add_argument("--baseline", action="store_true",
+                        help="compare against the baseline file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(args.select, args.quick, args.repeat)
+
+    with open(args.history, "a") as history:
+        history.write(json.dumps({"time": time.time(), "quick": args.quick,
+                                  "results": results}) + "\n")
+
+    if args.save_baseline:
+        with open(args.baseline_file, "w") as baseline:
+            json.dump(results, baseline, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline_file) as baseline:
+            flagged = regressions(results, json.load(baseline),
+                                  args.tolerance)
+        for name, quantity, old, new in flagged:
+            if quantity == "error":
+                print("REGRESSION {0}: failed: {1}".format(name, new))
+            else:
+                print("REGRESSION {0}: {1} {2:.4g} -> {3:.4g}".format(
+                    name, quantity, old, new))
+        if flagged:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+    Compare the distributed wind codes (new_stellar_wind with comm=...)
+    with the serial ones: for every mode, the wind particles and the lost
+    mass have to be identical on all ranks, and the gravity has to agree
+    up to the rounding of the sum over the ranks. The steady state wind
+    has to be the same on all ranks and in the serial code.
+
+    mpirun -n 4 python stellar_wind_mpi_check.py
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+
+import numpy
+
+from amuse.datamodel import Particles
+from amuse.units import units
+
+import stellar_wind
+from stellar_wind_benchmark import synthetic_cluster
+
+
+MODES = [("simple", {}),
+         ("mechanical", {}),
+         ("accelerate", {"v_init_ratio": 0.5, "compensate_gravity": True})]
+
+
+def evolved_wind(stars, mode, comm, time, **kwargs):
+    gas = Particles()
+    wind = stellar_wind.new_stellar_wind(
+        1e-9 | units.MSun, gas, 2. | units.day, mode=mode, comm=comm,
+        random_seed=7, **kwargs)
+    wind.particles.add_particles(stars)
+    wind.evolve_model(time)
+    return wind, gas
+
+
+def same_wind(distributed, serial):
+    (wind_d, gas_d), (wind_s, gas_s) = distributed, serial
+    if len(gas_d) != len(gas_s):
+        return False
+    return all((getattr(gas_d, name) == getattr(gas_s, name)).all()
+               for name in ["position", "velocity", "u", "mass"]) and (
+        wind_d.particles.lost_mass == wind_s.particles.lost_mass).all()
+
+
+def steady_state_digest(wind, number=500):
+    """
+        A fingerprint of the positions and velocities of a steady state
+        wind of 'number' particles.
+    """
+    digest = hashlib.sha1()
+    for chunk in wind.steady_state_wind(number=number, chunk_size=200):
+        for values in [chunk.position.value_in(units.m),
+                       chunk.velocity.value_in(units.m/units.s)]:
+            digest.update(numpy.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+def gravity_difference(distributed, serial, stars, n_points, random):
+    near = random.randint(0, len(stars), n_points)
+    offsets = (random.normal(0., 3., (n_points, 3))
+               * stars.radius[near].value_in(units.RSun)[:, None])
+    x, y, z = (stars.position[near] + (offsets | units.RSun)).transpose()
+    unit = units.m/units.s**2
+    found = [wind.get_gravity_at_point(0. | units.m, x, y, z).value_in(unit)
+             for wind in (distributed[0], serial[0])]
+    return abs(found[0] - found[1]).max() / abs(found[1]).max()
+
+
+def check(comm, n_stars, rtol):
+    stars = comm.bcast(synthetic_cluster(n_stars), root=0)
+    random = numpy.random.RandomState(1)
+    failed = []
+    for mode, kwargs in MODES:
+        distributed = evolved_wind(stars, mode, comm, 10. | units.day,
+                                   **kwargs)
+        serial = evolved_wind(stars, mode, None, 10. | units.day, **kwargs)
+        result = "{0} particles".format(len(serial[1]))
+        ok = same_wind(distributed, serial)
+        digest = steady_state_digest(distributed[0])
+        same_steady_state = (digest == steady_state_digest(serial[0])
+                             and len(set(comm.allgather(digest))) == 1)
+        if not same_steady_state:
+            result += ", steady state wind differs"
+        ok = ok and same_steady_state
+        if mode == "accelerate":
+            difference = gravity_difference(distributed, serial, stars, 1000,
+                                            random)
+            result += ", gravity differs by {0:.3g}".format(difference)
+            ok = ok and difference <= rtol
+        if not ok:
+            failed.append(mode)
+        print("rank {0}/{1} {2:12s} {3} {4}".format(
+            comm.rank, comm.size, mode, "OK" if ok else "DIFFERENT", result))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stars", type=int, default=11)
+    parser.add_argument("--rtol", type=float, default=1e-12,
+                        help="allowed relative difference of the gravity")
+    args = parser.parse_args()
+
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    failed = comm.allreduce(len(check(comm, args.stars, args.rtol)))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()